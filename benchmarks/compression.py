@@ -0,0 +1,70 @@
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.corpus import generate_documents, write_documents
+from preprocess.compression import open_file, output_suffix
+
+CODECS = [(None, None), ('gzip', 1), ('gzip', 6), ('zstd', 1), ('zstd', 3), ('zstd', 9)]
+
+
+def write_file(lines: list[bytes], file_path: str, codec, level):
+    with open_file(file_path, 'wb', codec, level) as f:
+        for line in lines:
+            f.write(line)
+
+
+def read_file(file_path: str):
+    # the same streaming read the normalization and the deduplication do
+    n_lines = 0
+    with open_file(file_path, 'rb') as f:
+        for _ in f:
+            n_lines += 1
+    return n_lines
+
+
+def measure(lines: list[bytes], out_dir: str, codec, level, repeat: int):
+    file_path = f'{out_dir}/corpus.jsonl{output_suffix(codec)}'
+    start = time.perf_counter()
+    write_file(lines, file_path, codec, level)
+    write_seconds = time.perf_counter() - start
+    read_seconds = None
+    for _ in range(repeat):
+        # reads from the page cache, the time saved on a cold disk is the difference in bytes on disk
+        start = time.perf_counter()
+        read_file(file_path)
+        seconds = time.perf_counter() - start
+        read_seconds = seconds if read_seconds is None else min(read_seconds, seconds)
+    disk_bytes = os.path.getsize(file_path)
+    os.remove(file_path)
+    return {'disk_mb': disk_bytes / 1e6, 'write_s': write_seconds, 'read_s': read_seconds}
+
+
+def run(n_docs: int, doc_words: int, repeat: int, disk_mb_per_s: float):
+    documents = generate_documents(n_docs, doc_words)
+    with tempfile.TemporaryDirectory() as out_dir:
+        write_documents(documents, f'{out_dir}/source.jsonl')
+        with open(f'{out_dir}/source.jsonl', 'rb') as f:
+            lines = f.readlines()
+        os.remove(f'{out_dir}/source.jsonl')
+        raw_mb = sum(map(len, lines)) / 1e6
+        print(f"{n_docs} documents, {raw_mb:.1f} MB, disk read at {disk_mb_per_s:.0f} MB/s")
+        for codec, level in CODECS:
+            result = measure(lines, out_dir, codec, level, repeat)
+            # a cold read costs the disk time of the compressed bytes plus the decompression
+            cold_s = max(result['disk_mb'] / disk_mb_per_s, result['read_s'])
+            print(f"{codec or 'none':>5} {level or '':>2} {result['disk_mb']:8.1f} MB x{raw_mb / result['disk_mb']:5.2f} "
+                  f"write {raw_mb / result['write_s']:7.1f} MB/s read {raw_mb / result['read_s']:7.1f} MB/s "
+                  f"cold read {raw_mb / cold_s:7.1f} MB/s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Size and streaming throughput of the jsonl compression codecs')
+    parser.add_argument('--docs', type=int, default=10000)
+    parser.add_argument('--words', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--disk-mb-per-s', type=float, default=200.0,
+                        help='sequential read speed of the disk the corpus lives on')
+    args = parser.parse_args()
+    run(args.docs, args.words, args.repeat, args.disk_mb_per_s)
@@ -0,0 +1,115 @@
+import argparse
+import csv
+import json
+import os
+import random
+
+import pyarrow as pa
+from pyarrow import parquet as pq
+
+from preprocess.compression import open_file, split_suffix
+
+PERSIAN_WORDS = ['سلام', 'کتاب', 'مدرسه', 'ایران', 'تهران', 'دانشگاه', 'زبان', 'فارسی', 'پردازش', 'خبرگزاری',
+                 'گزارش', 'اقتصاد', 'فرهنگ', 'ورزش', 'می‌شود', 'کرده‌اند', 'بین‌المللی', 'سال', 'دولت', 'مجلس',
+                 'پژوهش', 'فناوری', 'اطلاعات', 'شهر', 'مردم', 'آموزش', 'تاریخ', 'هنر', 'سینما', 'کتابخانه',
+                 'كتاب', 'يك', 'ۀ', '۱۴۰۲', '۲۵', '٪۲۰', 'ه . ش']
+LATIN_WORDS = ['news', 'data', 'model', 'GPT', 'NLP', 'the', 'of', '2024', 'https://t.me/channel/12', 'www.site.ir']
+DECORATIONS = ['😀', '🇮🇷', '<b>', '</b>', '<a href="x">', '</a>', '\u200e', '\u202b', '#هشتگ', '#خبر', '@user',
+               '!!!!', '...', '(', ')', '،', '؛', '.', '؟']
+SOURCES = ['socialMedia/telegram', 'papers/journal', 'baznashr/news', 'madlad', 'wikies/fa']
+FORMATS = ['jsonl', 'json', 'csv', 'parquet']
+
+
+def make_sentence(rng: random.Random, n_words: int, latin_rate: float):
+    words = []
+    for _ in range(n_words):
+        r = rng.random()
+        if r < latin_rate:
+            words.append(rng.choice(LATIN_WORDS))
+        elif r < latin_rate + 0.05:
+            words.append(rng.choice(DECORATIONS))
+        else:
+            words.append(rng.choice(PERSIAN_WORDS))
+    return ' '.join(words) + rng.choice(['.', '!', '؟', '.'])
+
+
+def make_document(rng: random.Random, doc_words: int, latin_rate: float):
+    lines = []
+    n_words = 0
+    while n_words < doc_words:
+        line_words = rng.randint(5, 40)
+        lines.append(' '.join(make_sentence(rng, rng.randint(3, 15), latin_rate)
+                              for _ in range(max(1, line_words // 9))))
+        n_words += line_words
+    return '\n'.join(lines)
+
+
+def near_duplicate(rng: random.Random, text: str):
+    # a copy with a few words changed, close enough to be found by the MinHash deduplication
+    words = text.split(' ')
+    for _ in range(max(1, len(words) // 50)):
+        words[rng.randrange(len(words))] = rng.choice(PERSIAN_WORDS)
+    return ' '.join(words)
+
+
+def generate_documents(n_docs: int, doc_words=300, duplicate_rate=0.2, latin_rate=0.1, seed=0):
+    rng = random.Random(seed)
+    documents = []
+    for i in range(n_docs):
+        if documents and rng.random() < duplicate_rate:
+            text = near_duplicate(rng, rng.choice(documents)['text'])
+        else:
+            text = make_document(rng, rng.randint(doc_words // 2, doc_words * 3 // 2), latin_rate)
+        documents.append({'text': text, 'source': SOURCES[i % len(SOURCES)], 'url': f'https://example.ir/{i}'})
+    return documents
+
+
+def write_documents(documents: list[dict], file_path: str):
+    # 'jsonl', 'json' and 'csv' files may also be written compressed, e.g. 'part0.jsonl.zst'
+    file_type, codec = split_suffix(file_path)
+    rows = [{'text': document['text'], 'url': document['url']} for document in documents]
+    if file_type == '.jsonl':
+        with open_file(file_path, 'wt', codec) as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+    elif file_type == '.json':
+        with open_file(file_path, 'wt', codec) as f:
+            json.dump(rows, f, ensure_ascii=False)
+    elif file_type == '.csv':
+        with open_file(file_path, 'wt', codec, newline='') as f:
+            writer = csv.DictWriter(f, ['text', 'url'])
+            writer.writeheader()
+            writer.writerows(rows)
+    elif file_type == '.parquet':
+        pq.write_table(pa.Table.from_pylist(rows), file_path)
+
+
+def generate_corpus(out_dir: str, n_docs: int, doc_words=300, duplicate_rate=0.2, latin_rate=0.1,
+                    formats=FORMATS, docs_per_file=1000, seed=0):
+    # files are laid out like the data folder: <out_dir>/<source>/<name>.<format>
+    documents = generate_documents(n_docs, doc_words, duplicate_rate, latin_rate, seed)
+    file_paths = []
+    for source in SOURCES:
+        source_documents = [document for document in documents if document['source'] == source]
+        os.makedirs(f'{out_dir}/{source}', exist_ok=True)
+        for k, start in enumerate(range(0, len(source_documents), docs_per_file)):
+            file_path = f'{out_dir}/{source}/part{k}.{formats[k % len(formats)]}'
+            write_documents(source_documents[start:start + docs_per_file], file_path)
+            file_paths.append(file_path)
+    return file_paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Deterministic synthetic Persian / mixed-script corpus')
+    parser.add_argument('out_dir', help='e.g. data/bench, then normalize it with preprocess_files("bench")')
+    parser.add_argument('--docs', type=int, default=10000)
+    parser.add_argument('--words', type=int, default=300, help='average words per document')
+    parser.add_argument('--duplicate-rate', type=float, default=0.2)
+    parser.add_argument('--latin-rate', type=float, default=0.1)
+    parser.add_argument('--formats', default=','.join(FORMATS))
+    parser.add_argument('--docs-per-file', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    paths = generate_corpus(args.out_dir, args.docs, args.words, args.duplicate_rate, args.latin_rate,
+                            args.formats.split(','), args.docs_per_file, args.seed)
+    print(f"{len(paths)} files written to {args.out_dir}")
@@ -0,0 +1,80 @@
+import argparse
+import os
+import tempfile
+from glob import glob
+
+from benchmarks.corpus import generate_documents, write_documents
+from preprocess.deduplication import Deduplication
+
+SUB_FOLDER = 'bench'
+
+
+def unique_documents(n_docs: int, seed: int):
+    # near duplicates but no byte-identical texts
+    return list({document['text']: document for document in generate_documents(n_docs, 60, seed=seed)}.values())
+
+
+def write_corpus(documents: list[dict], n_files: int):
+    # normalized files as the deduplication reads them, relative to the working directory
+    folder = f'./result/normalized/{SUB_FOLDER}/a'
+    os.makedirs(folder, exist_ok=True)
+    os.makedirs('./result/logs', exist_ok=True)
+    for k in range(n_files):
+        write_documents(documents[k::n_files], f'{folder}/part{k}.jsonl')
+
+
+def deduplicate(**kwargs):
+    Deduplication(**kwargs).preprocess_files(SUB_FOLDER)
+    rows = []
+    for shard_path in glob(f'./result/deduplication/{SUB_FOLDER}/*.jsonl'):
+        with open(shard_path, 'r', encoding='utf-8') as f:
+            rows.extend(f)
+    return sorted(rows)
+
+
+def check_no_copies(n_docs: int, seed: int):
+    # the exact stage finds nothing, the output must be that of a run without it
+    write_corpus(unique_documents(n_docs, seed), 3)
+    with_exact = deduplicate(incremental=False)
+    without_exact = deduplicate(incremental=False, exact=False)
+    if with_exact != without_exact:
+        raise AssertionError(f"a corpus without exact copies keeps {len(with_exact)} rows with the exact stage and "
+                             f"{len(without_exact)} without it")
+    print(f"no copies: {len(with_exact)} rows")
+
+
+def check_changed_file(n_docs: int, seed: int):
+    # a file changed between incremental runs, one of them without the exact stage, must give the output of a full run
+    documents = unique_documents(n_docs, seed)
+    write_corpus(documents, 3)
+    changed_path = f'./result/normalized/{SUB_FOLDER}/a/part1.jsonl'
+    # the file first ends with copies of another file, then its rows move and the copies are gone
+    write_documents(documents[1::3] + documents[0::3][:10], changed_path)
+    deduplicate(exact=True)
+    write_documents(documents[1::3][::-1], changed_path)
+    deduplicate(exact=False)
+    incremental = deduplicate(exact=True)
+    full = deduplicate(exact=True, incremental=False)
+    if incremental != full:
+        raise AssertionError(f"an incremental run keeps {len(incremental)} rows after a change, a full run {len(full)}")
+    print(f"changed file: {len(full)} rows")
+
+
+CHECKS = {'no_copies': check_no_copies, 'changed_file': check_changed_file}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Deduplication runs on synthetic corpora that must agree')
+    parser.add_argument('--checks', default=','.join(CHECKS))
+    parser.add_argument('--docs', type=int, default=1500)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    cwd = os.getcwd()
+    for name in args.checks.split(','):
+        with tempfile.TemporaryDirectory() as work_dir:
+            # the deduplication reads and writes ./result
+            os.chdir(work_dir)
+            try:
+                CHECKS[name](args.docs, args.seed)
+            finally:
+                os.chdir(cwd)
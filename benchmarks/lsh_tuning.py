@@ -0,0 +1,152 @@
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+from scipy import sparse
+
+from benchmarks.corpus import generate_documents
+from preprocess.compression import open_file
+from preprocess.minhash import SignatureEngine, band_keys, feature_text, shingles
+from preprocess.utils import get_all_files
+
+BINS = np.round(np.arange(0, 1.01, 0.1), 1)
+
+
+def sample_texts(sub_folder: str, n_docs: int, seed: int):
+    # whole normalized files in random order, so the near duplicates of a source stay together in the sample
+    file_paths = sorted(get_all_files(f'./result/normalized/{sub_folder}'))
+    random.Random(seed).shuffle(file_paths)
+    texts = []
+    for file_path in file_paths:
+        with open_file(file_path, 'rb') as fh:
+            for line in fh:
+                texts.append(json.loads(line)['text'])
+                if len(texts) == n_docs:
+                    return texts
+    return texts
+
+
+def exact_jaccard(texts: list[str], width: int):
+    # Jaccard similarity of the shingle sets of every pair, the ground truth the LSH settings are measured against
+    vocabulary = {}
+    rows, cols = [], []
+    for doc, text in enumerate(texts):
+        doc_shingles = set(shingles(feature_text(text), width))
+        cols.extend(vocabulary.setdefault(shingle, len(vocabulary)) for shingle in doc_shingles)
+        rows.extend([doc] * len(doc_shingles))
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)),
+                               shape=(len(texts), len(vocabulary)))
+    intersection = (matrix @ matrix.T).toarray()
+    sizes = np.diag(intersection)
+    union = sizes[:, None] + sizes[None, :] - intersection
+    upper = np.triu_indices(len(texts), 1)
+    # texts too short for a single shingle have equal (empty) sets, and equal signatures
+    return np.divide(intersection[upper], union[upper], out=np.ones(len(upper[0])), where=union[upper] > 0)
+
+
+def candidates(keys: np.ndarray):
+    # pairs sharing at least one band, and the number of pairs the deduplication writes to its pair files
+    # (every document of a bucket but the first, per band)
+    n_docs = len(keys)
+    matrix = np.zeros((n_docs, n_docs), dtype=bool)
+    n_pairs = 0
+    for band_idx in range(keys.shape[1]):
+        order = np.argsort(keys[:, band_idx], kind='stable')
+        sorted_keys = keys[order, band_idx]
+        bounds = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1], True])
+        n_pairs += n_docs - (len(bounds) - 1)
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if end - start > 1:
+                matrix[np.ix_(order[start:end], order[start:end])] = True
+    return matrix[np.triu_indices(n_docs, 1)], n_pairs
+
+
+def s_curve(jaccard: np.ndarray, is_candidate: np.ndarray):
+    # share of the pairs of every similarity bin that became candidates, None for empty bins
+    bins = np.clip(np.digitize(jaccard, BINS) - 1, 0, len(BINS) - 2)
+    counts = np.bincount(bins, minlength=len(BINS) - 1)
+    hits = np.bincount(bins, weights=is_candidate, minlength=len(BINS) - 1)
+    return [float(hit / count) if count else None for hit, count in zip(hits, counts)]
+
+
+def evaluate(jaccard: np.ndarray, keys: np.ndarray, threshold: float):
+    is_candidate, n_pairs = candidates(keys)
+    is_similar = jaccard >= threshold
+    n_candidates = int(is_candidate.sum())
+    n_similar = int(is_similar.sum())
+    return {'candidates': n_candidates, 'similar': n_similar,
+            # similar pairs that are never compared, and candidates below the threshold that would still be merged
+            'false_negative_rate': float((is_similar & ~is_candidate).sum() / max(n_similar, 1)),
+            'false_positive_rate': float((is_candidate & ~is_similar).sum() / max(n_candidates, 1)),
+            'pair_mb_per_million_docs': n_pairs / len(keys) * 16, 's_curve': s_curve(jaccard, is_candidate)}
+
+
+def run(texts: list[str], widths: list[int], bands: list[int], rows: list[int], threshold: float):
+    results = []
+    for width in widths:
+        jaccard = exact_jaccard(texts, width)
+        engine = SignatureEngine(num_perm=128, width=width)
+        start = time.perf_counter()
+        signatures = np.concatenate([engine.signatures(texts[i:i + 256]) for i in range(0, len(texts), 256)])
+        signature_seconds = time.perf_counter() - start
+        for band in bands:
+            for n_rows in rows:
+                if band * n_rows > 128:
+                    continue
+                start = time.perf_counter()
+                keys = band_keys(signatures, band, n_rows)
+                hash_seconds = signature_seconds + time.perf_counter() - start
+                result = {'width': width, 'band': band, 'rows': n_rows,
+                          # similarity at which a pair becomes a candidate with probability 1/2
+                          'midpoint': (1 - 0.5 ** (1 / band)) ** (1 / n_rows),
+                          'docs_per_s': len(texts) / hash_seconds, **evaluate(jaccard, keys, threshold)}
+                results.append(result)
+                curve = ' '.join('  -  ' if rate is None else f'{rate:5.2f}' for rate in result['s_curve'])
+                print(f"width {width:>2} band {band:>2} rows {n_rows:>2} midpoint {result['midpoint']:.2f} "
+                      f"FN {result['false_negative_rate']:6.3f} FP {result['false_positive_rate']:6.3f} "
+                      f"pairs {result['pair_mb_per_million_docs']:8.1f} MB/1M docs "
+                      f"hash {result['docs_per_s']:7.1f} docs/s | {curve}")
+    return results
+
+
+def cheapest(results: list[dict], max_false_negative: float, max_false_positive: float):
+    # fewest pair bytes, then fastest hashing, of the settings within both error rates
+    valid = [result for result in results if result['false_negative_rate'] <= max_false_negative and
+             result['false_positive_rate'] <= max_false_positive]
+    return min(valid, key=lambda result: (result['pair_mb_per_million_docs'], -result['docs_per_s']), default=None)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recall, precision and cost of the MinHash LSH settings on a sample')
+    parser.add_argument('sub_folder', nargs='?', help='sample ./result/normalized/<sub_folder>, a synthetic '
+                                                      'corpus with near duplicates without it')
+    parser.add_argument('--docs', type=int, default=2000, help='sample size, all pairs of it are compared')
+    parser.add_argument('--threshold', type=float, default=0.8, help='Jaccard similarity of a duplicate pair')
+    parser.add_argument('--widths', default='9,13')
+    parser.add_argument('--bands', default='4,6,9,12,16,20')
+    parser.add_argument('--rows', default='4,6,8,10,13')
+    parser.add_argument('--max-false-negative', type=float, default=0.05)
+    parser.add_argument('--max-false-positive', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='json file for all results')
+    args = parser.parse_args()
+    if args.sub_folder:
+        sample = sample_texts(args.sub_folder, args.docs, args.seed)
+    else:
+        sample = [document['text'] for document in generate_documents(args.docs, seed=args.seed)]
+    print(f"{len(sample)} documents, {len(sample) * (len(sample) - 1) // 2} pairs, threshold {args.threshold}, "
+          f"s-curve bins {' '.join(f'{b:.1f}' for b in BINS[:-1])}")
+    grid = run(sample, [int(w) for w in args.widths.split(',')], [int(b) for b in args.bands.split(',')],
+               [int(r) for r in args.rows.split(',')], args.threshold)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump({'docs': len(sample), 'threshold': args.threshold, 'bins': BINS.tolist(), 'results': grid}, f,
+                      indent=1)
+    best = cheapest(grid, args.max_false_negative, args.max_false_positive)
+    if best is None:
+        print("no setting meets the error rates, widen the grid or relax --max-false-negative/--max-false-positive")
+    else:
+        print(f"cheapest setting: Deduplication(band={best['band']}, rows={best['rows']}, width={best['width']}), "
+              f"FN {best['false_negative_rate']:.3f} FP {best['false_positive_rate']:.3f}")
@@ -0,0 +1,58 @@
+import argparse
+import random
+import time
+
+import numpy as np
+from datasketch import MinHash
+from datasketch.lean_minhash import LeanMinHash
+
+from preprocess.deduplication import get_features
+from preprocess.minhash import SignatureEngine
+
+WORDS = ['سلام', 'کتاب', 'مدرسه', 'ایران', 'تهران', 'دانشگاه', 'زبان', 'فارسی', 'پردازش', 'خبرگزاری', 'گزارش',
+         'اقتصاد', 'فرهنگ', 'ورزش', 'news', 'data', 'model', '۱۴۰۲', '2024', '،', '.']
+
+
+def make_texts(n_docs: int, n_words: int, seed=0):
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(WORDS) for _ in range(n_words)) for _ in range(n_docs)]
+
+
+def legacy_signatures(texts: list[str]):
+    signatures = []
+    for text in texts:
+        mini_hash = MinHash(num_perm=128)
+        [mini_hash.update(x.encode('utf8')) for x in get_features(text, 13)]
+        signatures.append(LeanMinHash(mini_hash).hashvalues)
+    return np.array(signatures, dtype=np.uint64)
+
+
+def engine_signatures(engine: SignatureEngine, texts: list[str], batch_size: int):
+    return np.concatenate([engine.signatures(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)])
+
+
+def run(n_docs: int, n_words: int, batch_size: int):
+    texts = make_texts(n_docs, n_words)
+    results = {}
+    start = time.perf_counter()
+    reference = legacy_signatures(texts)
+    results['MinHash.update'] = time.perf_counter() - start
+    for scheme in ['sha1', 'rolling']:
+        engine = SignatureEngine(scheme=scheme)
+        start = time.perf_counter()
+        signatures = engine_signatures(engine, texts, batch_size)
+        results[f'engine ({scheme}, v{engine.version})'] = time.perf_counter() - start
+        if scheme == 'sha1' and not np.array_equal(signatures, reference):
+            raise AssertionError("sha1 engine signatures differ from LeanMinHash")
+    for name, seconds in results.items():
+        print(f"{name:<24} {n_docs / seconds:>10.1f} docs/s  "
+              f"x{results['MinHash.update'] / seconds:.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='MinHash signature throughput')
+    parser.add_argument('--docs', type=int, default=2000)
+    parser.add_argument('--words', type=int, default=300)
+    parser.add_argument('--batch-size', type=int, default=256)
+    args = parser.parse_args()
+    run(args.docs, args.words, args.batch_size)
@@ -0,0 +1,96 @@
+import argparse
+import json
+import os
+import random
+import time
+from preprocess.instrumentation import Instrumentation
+from preprocess.preprocess_document import Preprocessor
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), 'data', 'normalization_golden.jsonl')
+SOURCES = ['socialMedia/telegram', 'papers/journal', 'baznashr/news', 'madlad', 'wikies/fa']
+FRAGMENTS = [
+    'سلام دنیا. این یک متن آزمایشی است که برای بررسی نرمال‌سازی نوشته شده است',
+    'دانشگاه تهران در سال ۱۴۰۲ هجری شمسی ( ه . ش ) تأسیس نشد و در ۱۳۱۳ ه . ق هم نه',
+    'The QUICK brown fox. jumps over THE lazy dog. Another sentence.here',
+    'متن با <b>تگ</b> و <a href="x">لینک</a> و <style>body {color: red}</style> باقی',
+    'ایموجی 😀😀 و پرچم 🇮🇷 و علامت ✂ و ❤️ و ‍ و ⁦متن⁩',
+    'نویسه‌های PDF‎‏‪‫ ‭‮ در متن',
+    'تکرار حروففففف و خیلیییییی زیااااد!!!!! ....',
+    'جدول: ۱۲۳۴ = ۵۶۷ + ۸۹۰ ؛ ٪۲۰ (۳۰) [۴۰] {۵۰} $۶۰ @۷۰ #۸۰ ^ & * "۹۰" \'۰\'',
+    'هشتگ #ایران و #تهران_زیبا در پایان توییت #خبر',
+    'هشتگ‌های # جدا و ##دوتایی و #foo-bar و #hello\'s و #ایران، و #a#b و #',
+    'لینک https://t.me/channel/123 و eitta.me/channel/45 منبع @user',
+    'انتهای پیام',
+    'بیشتر بخوانید',
+    'http://example.com/page',
+    'کوتاه',
+    'A. b. C. d ABC DEF. ghi',
+    'عدد 3.14 و 2,500 و ۱٬۰۰۰ و ١٢٣ عربی',
+    'كتاب عربي يكي با ي و ك عربی و ۀ و ة',
+    'فاصله‌های    زیاد\t\tو تب   در متن',
+    'مدل GPT و BERT و XLM-R در پردازش زبان طبیعی NLP استفاده می‌شوند.',
+    'جمله اول. جمله دوم! جمله سوم؟ جمله چهارم… جمله پنجم',
+]
+SEPARATORS = ['\n', '\n\n', ' ', '\r\n', '\n\t\n', '\\n', '/n', ' ', '\x0b', '. ', '\n<i\n>\n']
+
+
+def sample_documents(n_docs=300, seed=0):
+    rng = random.Random(seed)
+    documents = []
+    for i in range(n_docs):
+        parts = [rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 12))]
+        text = parts[0]
+        for part in parts[1:]:
+            text += rng.choice(SEPARATORS) + part
+        documents.append({'text': text, 'source': SOURCES[i % len(SOURCES)]})
+    return documents
+
+
+def update_golden(preprocessor: Preprocessor):
+    os.makedirs(os.path.dirname(GOLDEN_PATH), exist_ok=True)
+    with open(GOLDEN_PATH, 'w', encoding='utf-8') as f:
+        for document in sample_documents():
+            document['document'] = preprocessor.preprocess_document(document['text'], document['source'])
+            document['line'] = preprocessor.preprocess_line(document['text'], document['source'])
+            f.write(json.dumps(document, ensure_ascii=False) + '\n')
+
+
+def check_golden(preprocessor: Preprocessor):
+    n_docs = 0
+    with open(GOLDEN_PATH, 'r', encoding='utf-8') as f:
+        for i, line in enumerate(f):
+            golden = json.loads(line)
+            for name, method in [('document', preprocessor.preprocess_document), ('line', preprocessor.preprocess_line)]:
+                output = method(golden['text'], golden['source'])
+                if output != golden[name]:
+                    raise AssertionError(f"preprocess_{name} differs from the golden output on row {i}:\n"
+                                         f"{output!r}\n{golden[name]!r}")
+            n_docs += 1
+    print(f"golden outputs match on {n_docs} documents")
+
+
+def stage_timings(preprocessor: Preprocessor, repeat: int):
+    instrumentation = Instrumentation()
+    documents = sample_documents() * repeat
+    n_bytes = sum(len(document['text'].encode('utf-8')) for document in documents)
+    start = time.perf_counter()
+    for document in documents:
+        preprocessor.preprocess_document(document['text'], document['source'], instrumentation)
+    total = time.perf_counter() - start
+    print(f"preprocess_document: {len(documents) / total:.1f} docs/s, {n_bytes / total / 1e6:.2f} MB/s")
+    stages = instrumentation.to_dict()['all']
+    for stage, entry in sorted(stages.items(), key=lambda x: -x[1]['seconds']):
+        print(f"  {stage:<20} {entry['seconds']:8.3f}s {100 * entry['seconds'] / total:5.1f}% "
+              f"{entry['calls']:>8} calls {entry['bytes'] / 1e6:8.2f} MB")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Golden output check and stage timings of the normalization')
+    parser.add_argument('--update', action='store_true', help='rewrite the golden outputs from this version')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    preprocessor = Preprocessor()
+    if args.update:
+        update_golden(preprocessor)
+    check_golden(preprocessor)
+    stage_timings(preprocessor, args.repeat)
@@ -0,0 +1,139 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.corpus import generate_documents
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'data', 'baseline.json')
+STAGES = ['preprocess_line', 'preprocess_document', 'quality_filter', 'get_features', 'minhash', 'lsh_bucketing',
+          'components']
+
+
+def band_keys(texts: list[str]):
+    from preprocess.deduplication import Deduplication
+    from preprocess.minhash import SignatureEngine
+    engine = SignatureEngine()
+    deduplication = Deduplication()
+    return np.concatenate([deduplication.band_keys(engine.signatures(texts[i:i + 256]))
+                           for i in range(0, len(texts), 256)])
+
+
+def bucket_pairs(keys: np.ndarray):
+    from preprocess.bucketing import RECORD, iter_pairs, sort_records
+    pairs = []
+    for band_idx in range(keys.shape[1]):
+        records = np.empty(len(keys), dtype=RECORD)
+        records['band'] = keys[:, band_idx]
+        records['doc'] = np.arange(len(keys), dtype=np.uint64)
+        pairs.extend(iter_pairs([sort_records(records)]))
+    return np.concatenate(pairs)
+
+
+def prepare(stage: str, documents: list[dict]):
+    # untimed setup, returns the function that is timed
+    texts = [document['text'] for document in documents]
+    if stage in ['preprocess_line', 'preprocess_document', 'quality_filter']:
+        from preprocess.preprocess_document import Preprocessor
+        preprocessor = Preprocessor()
+        if stage == 'preprocess_line':
+            return lambda: [preprocessor.preprocess_line(d['text'], d['source']) for d in documents]
+        if stage == 'preprocess_document':
+            return lambda: [preprocessor.preprocess_document(d['text'], d['source']) for d in documents]
+        normalized = [preprocessor.preprocess_document(d['text'], d['source']) for d in documents]
+        return lambda: [preprocessor.quality_filter.check(text) for text in normalized if text]
+    if stage == 'get_features':
+        from preprocess.deduplication import get_features
+        return lambda: [get_features(text, 13) for text in texts]
+    if stage == 'minhash':
+        from preprocess.minhash import SignatureEngine
+        engine = SignatureEngine()
+        return lambda: [engine.signatures(texts[i:i + 256]) for i in range(0, len(texts), 256)]
+    keys = band_keys(texts)
+    if stage == 'lsh_bucketing':
+        return lambda: bucket_pairs(keys)
+    if stage == 'components':
+        from preprocess.components import UnionFind
+        pairs = bucket_pairs(keys).astype(np.int64)
+
+        def components():
+            union_find = UnionFind(len(texts))
+            union_find.union_pairs(pairs[:, 0], pairs[:, 1])
+            return union_find.drop_mask()
+        return components
+    raise ValueError(f"unknown stage: {stage}, expected one of {STAGES}")
+
+
+def run_stage(stage: str, params: dict):
+    # runs in a fresh process, so the peak RSS belongs to this stage only
+    documents = generate_documents(params['docs'], params['words'], params['duplicate_rate'], seed=params['seed'])
+    func = prepare(stage, documents)
+    n_bytes = sum(len(document['text'].encode('utf-8')) for document in documents)
+    best = None
+    for _ in range(params['repeat']):
+        start = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return {'seconds': best, 'docs_per_s': len(documents) / best, 'mb_per_s': n_bytes / best / 1e6,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def run(stages: list[str], params: dict):
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for stage in stages:
+        with context.Pool(1) as pool:
+            results[stage] = pool.apply(run_stage, (stage, params))
+        result = results[stage]
+        print(f"{stage:<20} {result['docs_per_s']:>10.1f} docs/s {result['mb_per_s']:>8.2f} MB/s "
+              f"{result['peak_rss_mb']:>8.1f} MB peak RSS")
+    return results
+
+
+def compare(results: dict, params: dict, tolerance: float):
+    # stages slower than (1 - tolerance) times the baseline throughput are regressions
+    if not os.path.exists(BASELINE_PATH):
+        print(f"no baseline at {BASELINE_PATH}, save one with --save-baseline")
+        return []
+    with open(BASELINE_PATH, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline['params'] != params:
+        print(f"baseline was measured with other parameters: {baseline['params']}")
+        return []
+    regressions = []
+    for stage, result in results.items():
+        if stage not in baseline['stages']:
+            continue
+        ratio = result['docs_per_s'] / baseline['stages'][stage]['docs_per_s']
+        print(f"{stage:<20} x{ratio:.2f} of the baseline")
+        if ratio < 1 - tolerance:
+            regressions.append(stage)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Throughput and memory of the hot paths on a synthetic corpus')
+    parser.add_argument('--stages', default=','.join(STAGES))
+    parser.add_argument('--docs', type=int, default=1000)
+    parser.add_argument('--words', type=int, default=300)
+    parser.add_argument('--duplicate-rate', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='the best of repeat runs is reported')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+    run_params = {'docs': args.docs, 'words': args.words, 'duplicate_rate': args.duplicate_rate, 'seed': args.seed,
+                  'repeat': args.repeat}
+    stage_results = run(args.stages.split(','), run_params)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump({'params': run_params, 'stages': stage_results}, f, indent=1)
+    elif compare(stage_results, run_params, args.tolerance):
+        sys.exit(1)
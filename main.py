@@ -1,12 +1,26 @@
+import argparse
 import time
 
 from preprocess.deduplication import Deduplication
 from preprocess.preprocess_document import Preprocessor
+from preprocess.resources import FIELDS, Resources
 
-start_time = time.time()
-preprocessor = Preprocessor(token_ratio_quality=False)
-deduplication = Deduplication()
 if __name__ == '__main__':
-    preprocessor.preprocess_files('papers', filtering=True)
-    # deduplication.preprocess_files('socialMedia')
+    parser = argparse.ArgumentParser(description='Normalize and deduplicate a data/ subfolder')
+    parser.add_argument('sub_folder', nargs='?', default='papers')
+    parser.add_argument('--deduplicate', action='store_true', help='deduplicate result/normalized/<sub_folder>')
+    parser.add_argument('--no-filtering', dest='filtering', action='store_false')
+    parser.add_argument('--resources', help='json file with resource settings, overridden by HODHOD_* variables')
+    for name in FIELDS:
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, dest=name)
+    args = parser.parse_args()
+
+    start_time = time.time()
+    resources = Resources.load(args.resources, **{name: getattr(args, name) for name in FIELDS})
+    print(f"resources: {resources.describe()}")
+    if args.deduplicate:
+        Deduplication(resources=resources).preprocess_files(args.sub_folder)
+    else:
+        Preprocessor(token_ratio_quality=False, resources=resources).preprocess_files(args.sub_folder,
+                                                                                      filtering=args.filtering)
     print("--- %s seconds ---" % (time.time() - start_time))
@@ -0,0 +1,55 @@
+import hashlib
+import os
+
+import numpy as np
+
+SKETCH_WIDTH = 1 << 22  # counters per row, a power of two
+SKETCH_DEPTH = 4
+# odd multipliers of the multiply-shift hash of every sketch row
+_multipliers = np.random.default_rng(0).integers(1, 1 << 63, size=SKETCH_DEPTH, dtype=np.uint64) * 2 + 1
+_shift = np.uint64(64 - SKETCH_WIDTH.bit_length() + 1)
+
+
+def line_key(line: str):
+    # boilerplate lines are compared without their spacing
+    return ' '.join(line.split())
+
+
+def key_hashes(keys):
+    raw = b''.join(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest() for key in keys)
+    return np.frombuffer(raw, dtype=np.uint64)
+
+
+def line_hashes(lines: list[str]):
+    # 64-bit hashes of the distinct non-empty lines, a line counts once per document
+    return key_hashes({line_key(line) for line in lines} - {''})
+
+
+class CountMinSketch:
+    # line frequencies of a source in SKETCH_DEPTH * SKETCH_WIDTH uint32 counters, whatever the number of lines.
+    # Counts are never underestimated, collisions can only raise them
+    def __init__(self, table=None):
+        self.table = np.zeros((SKETCH_DEPTH, SKETCH_WIDTH), dtype=np.uint32) if table is None else table
+
+    @staticmethod
+    def indices(hashes: np.ndarray):
+        return ((hashes[None, :] * _multipliers[:, None]) >> _shift).astype(np.int64)
+
+    def add(self, hashes: np.ndarray, counts: np.ndarray):
+        for row, indices in enumerate(self.indices(hashes)):
+            self.table[row] += np.bincount(indices, weights=counts, minlength=SKETCH_WIDTH).astype(np.uint32)
+
+    def query(self, hashes: np.ndarray):
+        return np.min([self.table[row][indices] for row, indices in enumerate(self.indices(hashes))], axis=0)
+
+    def digest(self):
+        return hashlib.blake2b(self.table.tobytes(), digest_size=16).hexdigest()
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.save(path, self.table)
+
+    @classmethod
+    def load(cls, path: str):
+        # memory mapped, the pool processes share the pages of the file
+        return cls(np.load(path, mmap_mode='r'))
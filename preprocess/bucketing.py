@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+
+# (band digest, document id) records of the run files, runs are sorted by band then document
+RECORD = np.dtype([('band', '<u8'), ('doc', '<u8')])
+
+
+def sort_records(records: np.ndarray):
+    return records[np.lexsort((records['doc'], records['band']))]
+
+
+def write_run(records: np.ndarray, run_path: str):
+    sort_records(records).tofile(run_path)
+
+
+def iter_merged(run_paths: list[str], block_records: int):
+    # k-way merge of sorted runs in blocks, at most len(run_paths) * block_records records are in memory
+    runs = [np.memmap(run_path, dtype=RECORD, mode='r') for run_path in run_paths if os.path.getsize(run_path)]
+    positions = [0] * len(runs)
+    while True:
+        blocks = [np.array(run[position:position + block_records]) for run, position in zip(runs, positions)]
+        bound = None
+        for run, position, block in zip(runs, positions, blocks):
+            # records after the smallest last record of a partially read run may still be followed by smaller ones
+            if len(block) and position + len(block) < len(run):
+                last = (int(block['band'][-1]), int(block['doc'][-1]))
+                bound = last if bound is None else min(bound, last)
+        parts = []
+        for i, block in enumerate(blocks):
+            if bound is not None:
+                band, doc = np.uint64(bound[0]), np.uint64(bound[1])
+                block = block[(block['band'] < band) | ((block['band'] == band) & (block['doc'] <= doc))]
+            positions[i] += len(block)
+            parts.append(block)
+        merged = np.concatenate(parts) if parts else np.empty(0, dtype=RECORD)
+        if not len(merged):
+            return
+        yield sort_records(merged)
+
+
+def merge_runs(run_paths: list[str], out_path: str, block_records: int):
+    with open(out_path, 'wb') as out:
+        for block in iter_merged(run_paths, block_records):
+            block.tofile(out)
+    [os.remove(run_path) for run_path in run_paths]
+
+
+def iter_pairs(blocks):
+    # pairs every document of a bucket with the first (smallest) document of that bucket
+    last_band, last_cand = None, np.uint64(0)
+    for block in blocks:
+        bands, docs = block['band'], block['doc']
+        starts = np.r_[True, bands[1:] != bands[:-1]]
+        if last_band is not None and bands[0] == last_band:
+            starts[0] = False
+        first = np.maximum.accumulate(np.where(starts, np.arange(len(bands)), -1))
+        cands = np.where(first >= 0, docs[np.maximum(first, 0)], last_cand)
+        yield np.stack([docs[~starts], cands[~starts]], axis=1)
+        last_band, last_cand = bands[-1], cands[-1]
@@ -0,0 +1,79 @@
+import os
+import re
+import shutil
+
+from .compression import READ_BLOCK, HashingReader, open_file, split_suffix
+
+_lines_pattern = re.compile(r'[^\n]*\n|[^\n]+')
+
+
+def plan_chunks(file_path: str, chunk_size: int):
+    # (start, end) byte ranges of about chunk_size bytes, every range starts right after a b'\n'
+    size = os.path.getsize(file_path)
+    boundaries = [0]
+    with open(file_path, 'rb') as fh:
+        while boundaries[-1] + chunk_size < size:
+            fh.seek(boundaries[-1] + chunk_size)
+            fh.readline()
+            if fh.tell() >= size:
+                break
+            boundaries.append(fh.tell())
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def count_lines(task):
+    # lines of a range as text mode reading (universal newlines) would count them: '\n', '\r\n' and a bare '\r'
+    file_path, start, end = task
+    n_lines = 0
+    last = b''
+    with open(file_path, 'rb') as fh:
+        fh.seek(start)
+        position = start
+        while position < end:
+            block = fh.read(min(READ_BLOCK, end - position))
+            if not block:
+                break
+            position += len(block)
+            n_lines += block.count(b'\n') + block.count(b'\r') - block.count(b'\r\n')
+            if last == b'\r' and block[:1] == b'\n':
+                n_lines -= 1
+            last = block[-1:]
+    return n_lines
+
+
+def iter_lines(file_path: str, start: int, end: int, digest=None):
+    # text lines of a byte range, split the same way as iterating a file opened in text mode. Compressed files
+    # are never chunked and are read whole. The raw bytes of the range are added to digest (a hashlib object)
+    if split_suffix(file_path)[1] is not None:
+        with HashingReader(file_path, digest) as raw, open_file(file_path, 'rt', fileobj=raw) as fh:
+            yield from fh
+        return
+    with open(file_path, 'rb') as fh:
+        fh.seek(start)
+        position = start
+        while position < end:
+            raw = fh.readline()
+            if not raw:
+                break
+            position += len(raw)
+            if digest is not None:
+                digest.update(raw)
+            line = raw.decode('utf-8')
+            if '\r' in line:
+                yield from _lines_pattern.findall(line.replace('\r\n', '\n').replace('\r', '\n'))
+            else:
+                yield line
+
+
+def part_path(res_path: str, part: int):
+    return f'{res_path}.{part}.part'
+
+
+def merge_parts(res_path: str, n_parts: int):
+    # outputs of the chunks of one file, concatenated in file order
+    with open(res_path, 'wb') as out:
+        for part in range(n_parts):
+            with open(part_path(res_path, part), 'rb') as f:
+                shutil.copyfileobj(f, out)
+            os.remove(part_path(res_path, part))
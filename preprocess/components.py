@@ -0,0 +1,69 @@
+import numpy as np
+
+
+class UnionFind:
+    # disjoint sets over dense node ids 0..n-1, stored in flat arrays (8 + 1 bytes per node). Pairs are merged a
+    # chunk at a time with array operations
+    def __init__(self, n: int):
+        self.parent = np.arange(n, dtype=np.int64)
+        self.rank = np.zeros(n, dtype=np.uint8)
+        self.n_unions = 0
+
+    def find(self, nodes: np.ndarray):
+        # roots of the nodes by pointer jumping, the paths of the nodes are compressed to their roots
+        roots = self.parent[nodes]
+        while True:
+            grand_parents = self.parent[roots]
+            if np.array_equal(grand_parents, roots):
+                break
+            roots = grand_parents
+        self.parent[nodes] = roots
+        return roots
+
+    def union_pairs(self, us: np.ndarray, vs: np.ndarray):
+        # the chunk is first collapsed on the roots it joins: min-label propagation gives every root the smallest
+        # root of its component within the chunk, then every such component is linked to one root by rank
+        ru, rv = self.find(us), self.find(vs)
+        joined = ru != rv
+        if not joined.any():
+            return
+        nodes, ends = np.unique(np.concatenate([ru[joined], rv[joined]]), return_inverse=True)
+        a, b = np.split(ends, 2)
+        labels = np.arange(len(nodes))
+        while len(a):
+            # every label is hooked to the smallest label it shares an edge with, then the paths are shortcut.
+            # Edges inside one label are done
+            la, lb = labels[a], labels[b]
+            crossing = la != lb
+            a, b, la, lb = a[crossing], b[crossing], la[crossing], lb[crossing]
+            np.minimum.at(labels, np.maximum(la, lb), np.minimum(la, lb))
+            while True:
+                grand_labels = labels[labels]
+                if np.array_equal(grand_labels, labels):
+                    break
+                labels = grand_labels
+        # the new root of a component is its root of the highest rank, its rank grows when several share it
+        ranks = self.rank[nodes]
+        order = np.lexsort((-ranks.astype(np.int16), labels))
+        starts = np.r_[True, labels[order][1:] != labels[order][:-1]]
+        new_roots = order[starts]
+        top = ranks[order] == ranks[new_roots][np.cumsum(starts) - 1]
+        self.parent[nodes[order]] = nodes[new_roots][np.cumsum(starts) - 1]
+        self.rank[nodes[new_roots]] += (np.add.reduceat(top, np.flatnonzero(starts)) > 1).astype(np.uint8)
+        self.n_unions += len(nodes) - len(new_roots)
+
+    def roots(self):
+        # full path compression by pointer jumping, vectorized over all nodes
+        roots = self.parent.copy()
+        while True:
+            grand_parents = roots[roots]
+            if np.array_equal(grand_parents, roots):
+                return roots
+            roots = grand_parents
+
+    def drop_mask(self):
+        # every node except the smallest one of its component
+        roots = self.roots()
+        drop = np.ones(len(roots), dtype=bool)
+        drop[np.unique(roots, return_index=True)[1]] = False
+        return drop, roots
@@ -0,0 +1,95 @@
+import gzip
+import io
+import os
+
+# compression suffix -> codec, detected on the full suffix so 'crawl.jsonl.gz' is a gzip compressed '.jsonl' file
+CODECS = {'.gz': 'gzip', '.zst': 'zstd'}
+SUFFIXES = {codec: suffix for suffix, codec in CODECS.items()}
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3}
+READ_BLOCK = 1 << 24  # bytes read at once from raw files and streams
+
+
+def split_suffix(file_path: str):
+    # ('.jsonl', 'gzip') for 'a/b.jsonl.gz', ('.jsonl', None) for 'a/b.jsonl'
+    root, suffix = os.path.splitext(file_path)
+    codec = CODECS.get(suffix)
+    if codec is None:
+        return suffix, None
+    return os.path.splitext(root)[-1], codec
+
+
+def strip_suffix(file_path: str):
+    # the path without its compression and file type suffixes
+    root, suffix = os.path.splitext(file_path)
+    if suffix in CODECS:
+        root = os.path.splitext(root)[0]
+    return root
+
+
+def output_suffix(codec=None):
+    return SUFFIXES[codec] if codec else ''
+
+
+class HashingReader(io.RawIOBase):
+    # raw bytes of a file for open_file(fileobj=...), every byte read is added to digest (a hashlib object, None
+    # hashes nothing). Closing reads what the reader on top left unread, so the digest covers the whole file
+    def __init__(self, file_path: str, digest=None):
+        self.fh = open(file_path, 'rb')
+        self.digest = digest
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n_bytes = self.fh.readinto(buffer)
+        if self.digest is not None:
+            self.digest.update(memoryview(buffer)[:n_bytes])
+        return n_bytes
+
+    def close(self):
+        if not self.closed:
+            if self.digest is not None:
+                for block in iter(lambda: self.fh.read(READ_BLOCK), b''):
+                    self.digest.update(block)
+            self.fh.close()
+        super().close()
+
+
+def open_file(file_path: str, mode='rt', codec=None, level=None, newline=None, fileobj=None):
+    # binary ('rb', 'wb') or utf-8 text ('rt', 'wt') stream of a plain, gzip or zstd file. Reading detects the
+    # codec from the suffix, writing uses the given one. Compressed streams only seek forward. fileobj is a binary
+    # stream of the raw bytes of file_path to read from instead of opening it
+    if codec is None and 'r' in mode:
+        codec = split_suffix(file_path)[1]
+    encoding = None if 'b' in mode else 'utf-8'
+    if codec is None:
+        if fileobj is not None:
+            stream = io.BufferedReader(fileobj, READ_BLOCK)
+            return stream if 'b' in mode else io.TextIOWrapper(stream, encoding=encoding, newline=newline)
+        return open(file_path, mode.replace('t', ''), encoding=encoding, newline=newline)
+    level = DEFAULT_LEVELS[codec] if level is None else level
+    source = file_path if fileobj is None else fileobj
+    if codec == 'gzip':
+        return gzip.open(source, mode, compresslevel=level, encoding=encoding, newline=newline)
+    if codec == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(f"reading or writing {file_path} needs the zstandard package: pip install zstandard")
+        cctx = zstandard.ZstdCompressor(level=level) if 'w' in mode else None
+        stream = zstandard.open(source, mode, cctx=cctx, encoding=encoding, newline=newline)
+        # the binary zstd reader has no readline, the buffered reader adds it
+        return io.BufferedReader(stream) if mode == 'rb' else stream
+    raise ValueError(f"unknown codec: {codec}, expected one of {list(SUFFIXES)}")
+
+
+def skip_to(fh, position: int, target: int):
+    # moves a binary stream from position forward to target, compressed streams are decompressed up to it
+    if fh.seekable():
+        fh.seek(target)
+        return
+    while position < target:
+        block = fh.read(min(target - position, READ_BLOCK))
+        if not block:
+            break
+        position += len(block)
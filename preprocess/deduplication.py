@@ -1,183 +1,622 @@
 import json
 import os
-import queue
-import re
-import string
+import shutil
 import time
 from collections import defaultdict
 from glob import glob
-from multiprocessing import Queue, Process
+from multiprocessing import Process, Pool
+from multiprocessing.connection import wait
 
-import networkit as nk
-from datasketch import MinHash
-from datasketch.lean_minhash import LeanMinHash
-from more_itertools import divide
-from nltk import ngrams
+import numpy as np
+from more_itertools import chunked, divide
 from tqdm import tqdm
 
+from .bucketing import RECORD, iter_merged, iter_pairs, merge_runs, write_run
+from .components import UnionFind
+from .compression import HashingReader, open_file, output_suffix, skip_to
+from .exact import RECORD as EXACT_RECORD, resolve_shard, text_digests, write_shards
+from .instrumentation import Instrumentation, source_group, timed
+from .lsh_index import LSHIndex, write_band
+from .manifest import new_digest
+from .minhash import SCHEMES, SignatureEngine, band_keys, feature_text, shingles
+from .resources import Resources
+from .signature_store import ROW_BITS, SignatureStore, doc_id, split_doc_ids
+from .transport import BlockTransport, TransportStats, read_transport_stats
 from .utils import get_all_files
 
 
-def _h_bytes(hs):
-    return bytes(hs.byteswap().data)
-
-
-def construct_graph(set_of_duplicate_pairs):
-    graph = nk.Graph()
-    mapper = {}
-    for pair in set_of_duplicate_pairs:
-        node1_name, node2_name = pair
-        if node1_name not in mapper:
-            mapper[node1_name] = graph.addNode()
-        if node2_name not in mapper:
-            mapper[node2_name] = graph.addNode()
-        graph.addEdge(mapper[node1_name], mapper[node2_name])
-    return graph, mapper
+def get_features(s: str, width: int):
+    return shingles(feature_text(s), width)
 
 
-def find_connected_components(graph):
-    cc = nk.components.ConnectedComponents(graph)
-    cc.run()
-    return cc.getComponents(), cc.numberOfComponents()
+def read_texts(lines: list[bytes]):
+    return [json.loads(line)['text'] for line in lines]
 
 
-def get_features(s: str, width: int):
-    # lower cased
-    s = s.lower()
-    re.sub(r"[\d٠١٢٣٤٥٦٧٨٩]+", " ", s)
-    s = s.replace('جمعه', '').replace('شنبه', '')
-    persian_numbers = ["یک", "دو", "سه", "چهار", "پنج", "شش", "هفت", "هشت", "نه", "ده"]
-    pattern = re.compile(f"({'|'.join(persian_numbers)})")
-    s = pattern.sub("", s)
-    # remove punctuation
-    s = s.translate(str.maketrans("", "", string.punctuation))
-    s = s.translate(str.maketrans("", "", "/:><؟!.،,?"))
-    # remove consecutive spaces, newlines, tabs in the middle and in the beginning / end
-    s = re.sub(r"\s+", " ", s.strip())
-    return map(lambda x: "".join(x), ngrams(s, width))
+def rewrite_file(task: dict):
+    # copies the surviving lines of one normalized file as raw bytes into shards of about shard_size bytes. Offsets
+    # and sizes are those of the decompressed lines, compressed inputs are read forward only
+    n_rows = task['rows']
+    dropped = np.unpackbits(np.fromfile(task['drop_path'], dtype=np.uint8), count=n_rows, bitorder='little')
+    rows = np.flatnonzero(dropped == 0)
+    starts = np.fromfile(task['offsets_path'], dtype=np.uint64)
+    ends = np.append(starts[1:], np.uint64(task['bytes']))
+    words = np.fromfile(task['words_path'], dtype=np.uint32)
+    sizes = (ends - starts)[rows]
+    shard_ids = (np.cumsum(sizes) - sizes) // np.uint64(task['shard_size'])
+    shards = []
+    position = 0
+    with open_file(task['file_path'], 'rb') as fh:
+        for shard_id in np.unique(shard_ids).tolist():
+            shard_rows = rows[shard_ids == shard_id]
+            shard_path = f"{task['shard_prefix']}-{shard_id}.jsonl{output_suffix(task['compression'])}"
+            # consecutive surviving lines are copied as one span
+            breaks = np.flatnonzero(np.diff(shard_rows) != 1) + 1
+            span_firsts = shard_rows[np.r_[0, breaks]]
+            span_lasts = shard_rows[np.r_[breaks - 1, len(shard_rows) - 1]]
+            with open_file(shard_path, 'wb', task['compression'], task['compression_level']) as out:
+                for start, end in zip(starts[span_firsts].tolist(), ends[span_lasts].tolist()):
+                    skip_to(fh, position, start)
+                    while start < end:
+                        chunk = fh.read(min(end - start, 1 << 24))
+                        out.write(chunk)
+                        start += len(chunk)
+                    position = end
+            shards.append({'path': shard_path, 'file': task['file_path'], 'rows': len(shard_rows),
+                           'words': int(words[shard_rows].sum()), 'bytes': int(sizes[shard_ids == shard_id].sum())})
+    return shards
 
 
 class Deduplication:
-    def __init__(self):
+    def __init__(self, bucketing='memory', memory_budget=None, band=9, rows=13, width=13, merge_fanin=256,
+                 signature_scheme='sha1', hash_batch_size=256, incremental=True, shard_size=1 << 30,
+                 compression=None, compression_level=None, exact=True, exact_shards=64, index=False, resources=None):
+        if band * rows > 128:
+            raise ValueError(f"band * rows must not exceed the 128 MinHash permutations, got {band} * {rows}")
+        self.resources = resources or Resources.load()  # processes per stage, see resources.py
         self.n_proc = 0
         self.lsh_folder = ""
-        self.BAND = 9
-        self.doc_queues = [Queue(1000000000) for _ in range(self.BAND)]
-        self.lsh_dicts = [defaultdict(list) for _ in range(self.BAND)]
-        self.width = 13
-        self.range = 13
+        self.BAND = band
+        self.bucketing = bucketing  # 'memory' keeps one dict per band, 'disk' uses sorted run files
+        # bytes of buffered band records shared by all hash workers
+        self.memory_budget = memory_budget or self.resources.dedup_memory
+        self.merge_fanin = merge_fanin  # maximum number of run files merged at once
+        self.transport = None  # shared memory blocks from the hash workers to the band workers
+        self.block_rows = 4096  # documents per block
+        self.transport_blocks = 32  # blocks in flight, producers wait when all of them are in use
+        self.width = width  # characters per shingle, python -m benchmarks.lsh_tuning compares settings
+        self.range = rows
+        self.signature_scheme = signature_scheme  # 'sha1' matches datasketch's LeanMinHash bit for bit
+        self.hash_batch_size = hash_batch_size  # documents hashed together by the signature engine
+        self.incremental = incremental  # reuse the band digests stored by previous runs for unchanged files
+        self.store = None
+        self.exact = exact  # link byte-identical texts to their first occurrence before the MinHash
+        self.exact_shards = exact_shards  # the digests of a shard are sorted in memory at once
+        self.file_ranks = {}  # position of every file in path order
+        self.n_exact = 0
+        self.index = index  # keep the signatures and a sorted band index for near duplicate lookups, see lsh_index.py
+        self.n_indexed = 0
+        self.pair_chunk = 1 << 20  # pairs read at once while building the components
+        self.bases = None  # first dense node of every file index
+        self.union_find = None
+        self.n_pairs = 0
+        self.shard_size = shard_size  # bytes per deduplicated output shard
+        self.compression = compression  # codec of the output shards, None, 'gzip' or 'zstd'
+        self.compression_level = compression_level
         self.lsh_out = ""
         self.duplicates = defaultdict()
         self.data_path = "result/normalized/"
+        self.instrumentation = None  # per stage time, calls and bytes, switched on by preprocess_files(instrument=True)
+
+    def __getstate__(self):
+        # pool tasks pickle the instance, the components are only needed by the parent
+        state = self.__dict__.copy()
+        state['union_find'] = None
+        state['transport'] = None
+        return state
+
+    def iter_signatures(self, file_path: str, copies: np.ndarray, digest=None):
+        # signatures of the rows that are not in copies, with the mask of those rows in the batch. The raw bytes of
+        # the file are added to digest (a hashlib object)
+        engine = SignatureEngine(num_perm=128, width=self.width, scheme=self.signature_scheme)
+        row = 0
+        with HashingReader(file_path, digest) as raw, open_file(file_path, 'rb', fileobj=raw) as fh:
+            for lines in chunked(fh, self.hash_batch_size):
+                texts = timed(self.instrumentation, 'read_json', read_texts, lines)
+                keep = ~np.isin(np.arange(row, row + len(lines)), copies)
+                row += len(lines)
+                yield (keep, timed(self.instrumentation, 'minhash', engine.signatures,
+                                   [text for text, is_kept in zip(texts, keep) if is_kept]),
+                       [len(line) for line in lines], [len(text.split()) for text in texts])
+
+    def band_keys(self, signatures: np.ndarray):
+        return band_keys(signatures, self.BAND, self.range)
+
+    def is_stored(self, file_path: str):
+        # segments of the current content, with the signatures the index needs. Files stored without them are
+        # hashed again, the others keep their segments whether the index is built or not
+        return self.store.is_current(file_path) and (not self.index or self.store.has_signatures(file_path))
+
+    def iter_band_keys(self, file_path: str):
+        # yields the document id and the band digests of every row of the file that is not an exact copy. Copies
+        # are not hashed, their band digests are stored as zeros
+        file_index = self.store.file_index(file_path)
+        copies = self.exact_copies(file_path)
+        if self.instrumentation is not None:
+            self.instrumentation.source = source_group(os.path.relpath(os.path.dirname(file_path), self.data_path))
+        if self.is_stored(file_path):
+            segment = timed(self.instrumentation, 'store_read', np.array, self.store.read_segment(file_path),
+                            n_bytes=os.path.getsize(self.store.segment_path(file_path)))
+            kept = ~np.isin(np.arange(len(segment)), copies)
+            # a row that was a copy in the last run but is not anymore has to be hashed again
+            if segment[kept].any(axis=1).all():
+                for row, band_keys in zip(np.flatnonzero(kept).tolist(), segment[kept].tolist()):
+                    yield doc_id(file_index, row), band_keys
+                return
+        row = 0
+        digest = new_digest()
+        with self.store.open_segment(file_path) as segment:
+            for keep, signatures, line_lengths, word_counts in self.iter_signatures(file_path, copies, digest):
+                band_keys = np.zeros((len(keep), self.BAND), dtype=np.uint64)
+                band_keys[keep] = timed(self.instrumentation, 'band_keys', self.band_keys, signatures)
+                all_signatures = None
+                if self.index:
+                    # copies are not in the index, their signatures are left at the maximum hash value
+                    all_signatures = np.full((len(keep), signatures.shape[1]), (1 << 32) - 1, dtype=np.uint64)
+                    all_signatures[keep] = signatures
+                timed(self.instrumentation, 'store_write', segment.append, band_keys, line_lengths, word_counts,
+                      all_signatures, n_bytes=band_keys.nbytes)
+                for doc_row, doc_band_keys in zip(np.flatnonzero(keep).tolist(), band_keys[keep].tolist()):
+                    yield doc_id(file_index, row + doc_row), doc_band_keys
+                row += len(keep)
+        self.store.mark_done(file_path, segment.position, digest.hexdigest())
+
+    def exact_digests(self, file_path: str):
+        # 128-bit digests of the normalized texts, kept in the signature store for unchanged files
+        digests = self.store.read_digests(file_path)
+        if digests is not None:
+            return digests
+        with open_file(file_path, 'rb') as fh:
+            digests = np.concatenate([text_digests(read_texts(lines)) for lines in chunked(fh, self.hash_batch_size)] +
+                                     [np.empty((0, 2), dtype=np.uint64)])
+        self.store.write_digests(file_path, digests)
+        return digests
+
+    def generate_exact(self, file_paths: list[str], process_id: int):
+        # every worker writes the digest records of its files to all shards
+        self.reset_instrumentation()
+        shard_files = [open(f'{self.lsh_folder}/exact/{shard}-{process_id}.bin', 'wb')
+                       for shard in range(self.exact_shards)]
+        for file_path in tqdm(file_paths, total=len(file_paths), desc='exact_hash'):
+            digests = timed(self.instrumentation, 'exact_digests', self.exact_digests, file_path,
+                            n_bytes=os.path.getsize(file_path))
+            rows = np.arange(len(digests), dtype=np.uint64)
+            records = np.empty(len(digests), dtype=EXACT_RECORD)
+            records['hi'], records['lo'] = digests[:, 0], digests[:, 1]
+            records['order'] = (np.uint64(self.file_ranks[file_path]) << np.uint64(ROW_BITS)) | rows
+            records['doc'] = (np.uint64(self.store.file_index(file_path)) << np.uint64(ROW_BITS)) | rows
+            write_shards(records, shard_files)
+        [f.close() for f in shard_files]
+        self.write_instrumentation(f'exact{process_id}')
+
+    def resolve_exact_shard(self, shard: int):
+        shard_paths = glob(f'{self.lsh_folder}/exact/{shard}-*.bin')
+        copies = resolve_shard(shard_paths, f'{self.lsh_folder}/exact/pairs{shard}.bin')
+        [os.remove(shard_path) for shard_path in shard_paths]
+        return copies
+
+    def exact_deduplicate(self, parts, all_files: list[str]):
+        # byte-identical texts are found by their digests in hash sharded files. Later copies are paired with the
+        # first occurrence and skipped by the MinHash, which gives the same components as hashing them
+        exact_folder = f'{self.lsh_folder}/exact'
+        if os.path.exists(exact_folder):
+            shutil.rmtree(exact_folder)
+        os.makedirs(exact_folder)
+        if not self.exact:
+            return
+        self.file_ranks = {file_path: rank for rank, file_path in enumerate(sorted(all_files))}
+        processes = []
+        for process_id in range(self.n_proc):
+            p = Process(
+                target=self.generate_exact,
+                args=(list(parts[process_id]), process_id,),
+            )
+            processes.append(p)
+            p.start()
+        [process.join() for process in processes]
+        self.check_workers(processes, 'exact digest')
+        with Pool(processes=self.n_proc) as pool:
+            copies = list(tqdm(pool.imap_unordered(self.resolve_exact_shard, range(self.exact_shards)),
+                               total=self.exact_shards, desc='exact_shards'))
+        copies = np.concatenate(copies)
+        self.n_exact = len(copies)
+        if not self.n_exact:
+            return
+        # the rows of the copies of every file, read by the hash workers
+        file_indices, rows = split_doc_ids(copies)
+        order = np.argsort(file_indices, kind='stable')
+        file_indices, rows = file_indices[order], rows[order]
+        bounds = np.flatnonzero(np.r_[True, file_indices[1:] != file_indices[:-1], True])
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            np.sort(rows[start:end]).astype(np.uint32).tofile(f'{exact_folder}/{file_indices[start]}.copies')
+
+    @staticmethod
+    def check_workers(processes: list[Process], name: str):
+        failed = [process for process in processes if process.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {len(processes)} {name} workers failed, see the traceback above")
+
+    def exact_copies(self, file_path: str):
+        copies_path = f'{self.lsh_folder}/exact/{self.store.file_index(file_path)}.copies'
+        if not os.path.exists(copies_path):
+            return np.empty(0, dtype=np.uint32)
+        return np.fromfile(copies_path, dtype=np.uint32)
+
+    def union_exact_pairs(self):
+        for pairs_path in sorted(glob(f'{self.lsh_folder}/exact/pairs*.bin')):
+            timed(self.instrumentation, 'union_pairs', self.union_pairs, pairs_path,
+                  n_bytes=os.path.getsize(pairs_path))
+
+    def reset_instrumentation(self):
+        # forked hash workers start without the stages the parent recorded so far
+        if self.instrumentation is not None:
+            self.instrumentation = Instrumentation()
+
+    def write_instrumentation(self, name):
+        # hash workers are separate processes, the parent sums their files in collect_instrumentation
+        if self.instrumentation is not None:
+            self.instrumentation.write(f'{self.lsh_folder}/instrumentation/{name}.json')
+
+    def collect_instrumentation(self):
+        for path in glob(f'{self.lsh_folder}/instrumentation/*.json'):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.instrumentation += Instrumentation.from_dict(json.load(f))
+
+    def generate_hash(self, file_paths: list[str], process_id: int):
+        # hash worker: rows of (document id, band digests) are written into shared blocks sent to every band worker
+        self.reset_instrumentation()
+        stats = TransportStats(f'hash{process_id}')
+        block, n_rows = None, 0
+        for file_path in tqdm(file_paths, total=len(file_paths), desc='generate_hash'):
+            for doc, band_keys in self.iter_band_keys(file_path):
+                if block is None:
+                    block = stats.wait(self.transport.acquire)
+                self.transport.blocks[block, n_rows, 0] = doc
+                self.transport.blocks[block, n_rows, 1:] = band_keys
+                n_rows += 1
+                if n_rows == self.transport.block_rows:
+                    self.transport.send(block, n_rows)
+                    stats.add(n_rows, self.BAND)
+                    block, n_rows = None, 0
+        if block is not None:
+            self.transport.send(block, n_rows)
+            stats.add(n_rows, self.BAND)
+        self.transport.end_stream()
+        stats.write(f'{self.lsh_folder}/transport')
+        self.write_instrumentation(process_id)
+
+    def generate_hash_runs(self, file_paths: list[str], process_id: int):
+        self.reset_instrumentation()
+        runs_folder = f'{self.lsh_folder}/runs'
+        buffer_records = max(1, self.memory_budget // self.n_proc // self.BAND // RECORD.itemsize)
+        buffers = np.empty((self.BAND, buffer_records), dtype=RECORD)
+        n_buffered = 0
+        n_runs = 0
+
+        def flush():
+            for band_idx in range(self.BAND):
+                timed(self.instrumentation, 'write_runs', write_run, buffers[band_idx, :n_buffered],
+                      f'{runs_folder}/band{band_idx}-{process_id}-{n_runs}.bin', n_bytes=n_buffered * RECORD.itemsize)
 
-    def generate_hash(self, file_paths: list[str]):
         for file_path in tqdm(file_paths, total=len(file_paths), desc='generate_hash'):
-            with open(file_path, 'r', encoding='utf-8') as fh:
-                for line in fh:
-                    json_data = json.loads(line)
-                    map_text = get_features(json_data['text'], self.width)
-                    mini_hash = MinHash(num_perm=128)
-                    [mini_hash.update(x.encode('utf8')) for x in map_text]
-                    lean_minhash = LeanMinHash(mini_hash)
-                    for i, doc_queue in enumerate(self.doc_queues):
-                        h_bytes = _h_bytes(lean_minhash.hashvalues[
-                                           i * self.range: min((i + 1) * self.range, len(lean_minhash.hashvalues))])
-                        doc_queue.put((f'{file_path}@{json_data["id"]}', h_bytes))
-                    del mini_hash
-                    del lean_minhash
-        for doc_queue in self.doc_queues:
-            doc_queue.put(("Done", "Done"))
-        # print("PROCESS DONE")
-
-    def lsh(self, doc_queue, lsh_dict, idx):
-        i = 0
-        done_process = 0
+            for doc, band_keys in self.iter_band_keys(file_path):
+                buffers['band'][:, n_buffered] = band_keys
+                buffers['doc'][:, n_buffered] = doc
+                n_buffered += 1
+                if n_buffered == buffer_records:
+                    flush()
+                    n_runs += 1
+                    n_buffered = 0
+        if n_buffered:
+            flush()
+        self.write_instrumentation(process_id)
+
+    def lsh(self, idx: int):
+        # band worker: the first document of every band digest is the candidate of the ones that follow
+        stats = TransportStats(f'lsh{idx}')
+        lsh_dict = {}
+        n_ended = 0
         pbar = tqdm(desc=f'lsh{idx}: ')
-        with open(f'{self.lsh_folder}/deduplication{idx}.txt', 'w', encoding='utf-8') as f:
-            while True:
-                try:
-                    key, h_bytes = doc_queue.get(timeout=30)
-                    if key == "Done":
-                        done_process += 1
-                        print(f'done processes for {idx}: {done_process}')
-                        continue
-                    cand = lsh_dict.get(h_bytes, "None")
-                    if cand != "None":
-                        f.write(f'{key} :: {cand}\n')
+        pairs = []
+        with open(f'{self.lsh_folder}/pairs{idx}.bin', 'wb') as f:
+            while n_ended < self.n_proc:
+                message = stats.wait(self.transport.receive, idx)
+                if message is None:
+                    n_ended += 1
+                    continue
+                block, n_rows = message
+                docs = self.transport.blocks[block, :n_rows, 0].tolist()
+                band_keys = self.transport.blocks[block, :n_rows, 1 + idx].tolist()
+                self.transport.release(block)
+                stats.add(n_rows, 1)
+                for doc, band_key in zip(docs, band_keys):
+                    cand = lsh_dict.get(band_key)
+                    if cand is not None:
+                        pairs.append((doc, cand))
+                        if len(pairs) == 65536:
+                            np.array(pairs, dtype=np.uint64).tofile(f)
+                            pairs = []
                     else:
-                        lsh_dict[h_bytes] = key
-                    pbar.update(1)
-                except queue.Empty:
-                    if done_process == self.n_proc:
-                        lsh_dict = {}
-                        doc_queue = Queue(10)
-                        pbar.close()
-                        break
-        print(f"process {idx}: Done")
-        print(f"Total number of documents {idx}: {i}")
+                        lsh_dict[band_key] = doc
+                pbar.update(n_rows)
+            np.array(pairs, dtype=np.uint64).reshape(-1, 2).tofile(f)
+        pbar.close()
+        stats.write(f'{self.lsh_folder}/transport')
+        print(f"process {idx}: Done, {stats.rows} documents")
 
-    def generate_pairs(self, all_files: list[str]):
-        self.n_proc = 4
-        parts = divide(self.n_proc, all_files)
-        print(f"resetting to {self.n_proc} for number of processes")
+    def block_records(self, n_runs: int, n_merging: int):
+        # records read per run and merge step, so that all merging processes together stay within the budget
+        return max(1024, self.memory_budget // (2 * RECORD.itemsize * max(1, n_runs) * n_merging))
+
+    def reduce_runs(self, run_paths: list[str], prefix: str, n_merging: int):
+        level = 0
+        # merge in several passes when there are more runs than files we are willing to keep open
+        while len(run_paths) > self.merge_fanin:
+            merged_paths = []
+            for start in range(0, len(run_paths), self.merge_fanin):
+                merged_path = f'{prefix}-{level}-{start}.bin'
+                merge_runs(run_paths[start:start + self.merge_fanin], merged_path,
+                           self.block_records(self.merge_fanin, n_merging))
+                merged_paths.append(merged_path)
+            run_paths = merged_paths
+            level += 1
+        return run_paths
+
+    def merge_band(self, band_idx: int):
+        n_merging = min(self.resources.merge_workers, self.BAND)
+        run_paths = self.reduce_runs(sorted(glob(f'{self.lsh_folder}/runs/band{band_idx}-*.bin')),
+                                     f'{self.lsh_folder}/runs/merged{band_idx}', n_merging)
+        n_pairs = 0
+        with open(f'{self.lsh_folder}/pairs{band_idx}.bin', 'wb') as f:
+            for pairs in iter_pairs(iter_merged(run_paths, self.block_records(len(run_paths), n_merging))):
+                pairs.tofile(f)
+                n_pairs += len(pairs)
+        return band_idx, n_pairs
+
+    def index_band(self, band_idx: int):
+        # sorted runs of the (band digest, document id) records of one band, read from the store segments and
+        # merged into the digest and document id files of the index
+        index_folder = f'{self.lsh_folder}/index'
+        n_merging = min(self.resources.merge_workers, self.BAND)
+        buffer_records = max(1, self.memory_budget // n_merging // RECORD.itemsize)
+        run_paths = []
+        parts = []
+        n_buffered = 0
+        for file_path, entry in self.store.files.items():
+            segment = self.store.read_segment(file_path)
+            # exact copies have no band digests
+            rows = np.flatnonzero(segment.any(axis=1))
+            records = np.empty(len(rows), dtype=RECORD)
+            records['band'] = segment[rows, band_idx]
+            records['doc'] = (np.uint64(entry['index']) << np.uint64(ROW_BITS)) | rows.astype(np.uint64)
+            parts.append(records)
+            n_buffered += len(records)
+            if n_buffered >= buffer_records:
+                run_paths.append(f'{index_folder}/runs/band{band_idx}-{len(run_paths)}.bin')
+                write_run(np.concatenate(parts), run_paths[-1])
+                parts = []
+                n_buffered = 0
+        if parts:
+            run_paths.append(f'{index_folder}/runs/band{band_idx}-{len(run_paths)}.bin')
+            write_run(np.concatenate(parts), run_paths[-1])
+        run_paths = self.reduce_runs(run_paths, f'{index_folder}/runs/merged{band_idx}', n_merging)
+        n_records = write_band(iter_merged(run_paths, self.block_records(len(run_paths), n_merging)),
+                               f'{index_folder}/band{band_idx}.keys', f'{index_folder}/band{band_idx}.docs')
+        [os.remove(run_path) for run_path in run_paths]
+        return n_records
+
+    def build_index(self):
+        index_folder = f'{self.lsh_folder}/index'
+        if os.path.exists(index_folder):
+            shutil.rmtree(index_folder)
+        os.makedirs(f'{index_folder}/runs')
+        with Pool(processes=min(self.resources.merge_workers, self.BAND)) as pool:
+            counts = list(tqdm(pool.imap_unordered(self.index_band, range(self.BAND)), total=self.BAND, desc='index'))
+        shutil.rmtree(f'{index_folder}/runs')
+        self.n_indexed = counts[0]
+        with open(f'{index_folder}/index.json', 'w', encoding='utf-8') as f:
+            json.dump({'config': self.store.config, 'signatures': self.store.n_signatures, 'store': self.store.folder,
+                       'documents': self.n_indexed,
+                       'files': {entry['index']: file_path for file_path, entry in self.store.files.items()}},
+                      f, ensure_ascii=False)
+
+    def load_index(self, sub_folder_name: str):
+        return LSHIndex(f'./result/lsh/{sub_folder_name}/index')
+
+    def init_components(self, all_files: list[str]):
+        # dense node ids follow (path, row) order, so the smallest node of a component is its first document
+        self.bases = np.zeros(self.store.next_index, dtype=np.int64)
+        n_docs = 0
+        for file_path in sorted(all_files):
+            self.bases[self.store.file_index(file_path)] = n_docs
+            n_docs += self.store.files[file_path]['rows']
+        self.union_find = UnionFind(n_docs)
+        self.n_pairs = 0
+
+    def timed_union_pairs(self, band_idx: int):
+        pairs_path = f'{self.lsh_folder}/pairs{band_idx}.bin'
+        timed(self.instrumentation, 'union_pairs', self.union_pairs, pairs_path, n_bytes=os.path.getsize(pairs_path))
+
+    def union_pairs(self, pairs_path: str):
+        with open(pairs_path, 'rb') as f:
+            while True:
+                pairs = np.fromfile(f, dtype=np.uint64, count=2 * self.pair_chunk).reshape(-1, 2)
+                if not len(pairs):
+                    break
+                file_indices, rows = split_doc_ids(pairs)
+                nodes = self.bases[file_indices.astype(np.int64)] + rows.astype(np.int64)
+                self.union_find.union_pairs(nodes[:, 0], nodes[:, 1])
+                self.n_pairs += len(pairs)
+
+    def generate_pairs_on_disk(self, parts, all_files: list[str]):
+        runs_folder = f'{self.lsh_folder}/runs'
+        if os.path.exists(runs_folder):
+            shutil.rmtree(runs_folder)
+        os.makedirs(runs_folder)
         processes = []
+        for process_id in range(self.n_proc):
+            p = Process(
+                target=self.generate_hash_runs,
+                args=(list(parts[process_id]), process_id,),
+            )
+            processes.append(p)
+            p.start()
+        [process.join() for process in processes]
+        # runs and segments of a crashed worker are incomplete, nothing of this run may be committed
+        self.check_workers(processes, 'hash')
+        self.store.commit(all_files)
+        self.init_components(all_files)
+        self.union_exact_pairs()
+
+        # bands are merged by a fixed size pool, so BAND is not bounded by the number of processes
+        start = time.perf_counter()
+        with Pool(processes=min(self.resources.merge_workers, self.BAND)) as pool:
+            for band_idx, n_pairs in tqdm(pool.imap_unordered(self.merge_band, range(self.BAND)),
+                                          total=self.BAND, desc='merge_bands'):
+                print(f"band {band_idx}: {n_pairs} pairs")
+                # the components are built while the other bands are still merging
+                self.timed_union_pairs(band_idx)
+        if self.instrumentation is not None:
+            # wall time of merging and building the components together, union_pairs is also counted on its own
+            self.instrumentation.add('merge_bands', time.perf_counter() - start)
+        shutil.rmtree(runs_folder)
 
+    def generate_pairs(self, all_files: list[str]):
+        self.n_proc = self.resources.hash_workers
+        parts = [list(part) for part in divide(self.n_proc, all_files)]
+        print(f"resetting to {self.n_proc} for number of processes")
+        [os.remove(fp) for fp in glob(f"{self.lsh_folder}/pairs*.bin")]
+        [os.remove(fp) for fp in glob(f"{self.lsh_folder}/instrumentation/*.json")]
+        [os.remove(fp) for fp in glob(f"{self.lsh_folder}/transport/*.json")]
+        store_config = {'format': 4, 'scheme': self.signature_scheme, 'version': SCHEMES[self.signature_scheme],
+                        'width': self.width, 'band': self.BAND, 'rows': self.range}
+        self.store = SignatureStore(f'{self.lsh_folder}/store', store_config, 128 if self.index else 0)
+        if not self.incremental:
+            self.store.clear()
+        self.store.register(all_files)
+        with Pool(processes=self.n_proc) as pool:
+            timed(self.instrumentation, 'refresh', self.store.refresh, all_files, pool, n_bytes=0)
+        n_stored = sum(self.is_stored(file_path) for file_path in all_files)
+        print(f"{n_stored} of {len(all_files)} files are already in the signature store")
+        timed(self.instrumentation, 'exact', self.exact_deduplicate, parts, all_files, n_bytes=0)
+        print(f"{self.n_exact} documents are exact copies")
+        if self.bucketing == 'disk':
+            return self.generate_pairs_on_disk(parts, all_files)
+        self.transport = BlockTransport(self.n_proc, self.BAND, 1 + self.BAND, self.block_rows, self.transport_blocks)
+        hash_processes = []
         for process_id in range(self.n_proc):
             p = Process(
                 target=self.generate_hash,
-                args=(list(parts[process_id]),),
+                args=(list(parts[process_id]), process_id,),
             )
-            processes.append(p)
+            hash_processes.append(p)
             p.start()
-        # [process.join() for process in processes]
-        # processes = []
+        band_processes = []
         for process_id in range(self.BAND):
             p = Process(
                 target=self.lsh,
-                args=(self.doc_queues[process_id], self.lsh_dicts[process_id], process_id,),
+                args=(process_id,),
             )
-            processes.append(p)
+            band_processes.append(p)
             p.start()
-        [process.join() for process in processes]
-
-        return self.lsh_dicts
+        for process in hash_processes:
+            while process.is_alive():
+                process.join(timeout=1)
+                if any(band_process.exitcode not in (None, 0) for band_process in band_processes):
+                    # its blocks are never released, the hash workers waiting for one stop
+                    self.transport.abort()
+        failed = [process for process in hash_processes if process.exitcode != 0]
+        # the band workers of a crashed hash worker still get its end of stream, then the run fails
+        [self.transport.end_stream() for _ in failed]
+        if not failed:
+            # the rows of every file are known once the hash workers are done, the store is committed at the end
+            self.store.load_markers()
+            self.init_components(all_files)
+            self.union_exact_pairs()
+        # the pairs of a band are added to the components as soon as its worker exits, while the others still run
+        running = {process.sentinel: band_idx for band_idx, process in enumerate(band_processes)}
+        while running:
+            for sentinel in wait(list(running)):
+                band_idx = running.pop(sentinel)
+                band_processes[band_idx].join()
+                if not failed and band_processes[band_idx].exitcode == 0:
+                    self.timed_union_pairs(band_idx)
+        self.transport.close()
+        self.transport = None
+        if failed or any(process.exitcode != 0 for process in band_processes):
+            raise RuntimeError("a hash or band worker failed, see its traceback above")
+        self.store.commit(all_files)
 
     def generate_connected_components_mp(self, log_file):
         start = time.time()
-        files = glob(f"{self.lsh_folder}/*")
-        print("Started graph building")
-        set_of_duplicate_pairs = set()
-        for fp in files:
-            with open(fp, "r", encoding='utf-8') as f:
-                for line in f:
-                    pair = tuple(line.strip().split(" :: "))
-                    if pair[0] != pair[1]:
-                        set_of_duplicate_pairs.add(pair)
-        log_file.write(f"length of the set of duplicates: {len(set_of_duplicate_pairs)}\n")
-
-        # generate a graph using id's as nodes and a pair of ids as an edge
-        nk.setNumberOfThreads(60)
-        graph, mapper = construct_graph(set_of_duplicate_pairs)
-        components, n_components = find_connected_components(graph)
+        log_file.write(f"Resources: {self.resources.describe()}, memory_budget={self.memory_budget}\n")
+        log_file.write(f"number of exact copies: {self.n_exact}\n")
+        for stats in read_transport_stats(f'{self.lsh_folder}/transport'):
+            log_file.write(f"transport {stats['name']}: {stats['blocks']} blocks, {stats['rows']} rows, "
+                           f"{stats['messages'] / max(stats['seconds'], 1e-9):.1f} messages/s, "
+                           f"blocked {stats['blocked']:.3f} of {stats['seconds']:.3f}s\n")
+        log_file.write(f"number of duplicate pairs: {self.n_pairs}\n")
+        if self.index:
+            log_file.write(f"near duplicate index: {self.n_indexed} documents in {self.lsh_folder}/index\n")
+        drop, roots = timed(self.instrumentation, 'components', self.union_find.drop_mask)
+        n_components = np.count_nonzero(np.bincount(roots, minlength=len(roots)) > 1)
         log_file.write(f"number of connected components: {n_components}, {time.time() - start:.3f}s\n")
 
-        reversed_mapper = {value: key for key, value in mapper.items()}
-        log_file.write(f"Graph generated duplicates list!!!: {time.time() - start:.3f}s\n")
-
-        duplicates = defaultdict(set)
-        n_duplicate_docs = 0
-        for component in components:
-            for j in range(1, len(component)):
-                doc = reversed_mapper[component[j]]
-                file_name, doc_idx = doc.split("@")
-                duplicates[file_name].add(str(doc_idx))
-                n_duplicate_docs += 1
+        # one bit per row of every input file, set for the documents that will be removed
+        drop_folder = f'{self.lsh_folder}/drop'
+        if os.path.exists(drop_folder):
+            shutil.rmtree(drop_folder)
+        os.makedirs(drop_folder)
+        duplicates = {}
+        for file_path, entry in self.store.files.items():
+            base = self.bases[entry['index']]
+            duplicates[file_path] = np.packbits(drop[base:base + entry['rows']], bitorder='little')
+            duplicates[file_path].tofile(f"{drop_folder}/{entry['index']}.bits")
 
-        log_file.write(f"number of duplicate documents that will be removed:{n_duplicate_docs}\n")
+        log_file.write(f"number of duplicate documents that will be removed:{np.count_nonzero(drop)}\n")
         return duplicates
 
-    def preprocess_files(self, sub_folder_name: str):
+    def rewrite_files(self, all_files: list[str], sub_folder_name: str, res_folder: str):
+        out_folder = f'{res_folder}/{sub_folder_name}'
+        if os.path.exists(out_folder):
+            shutil.rmtree(out_folder)
+        os.makedirs(out_folder)
+        tasks = []
+        for file_path in all_files:
+            entry = self.store.files[file_path]
+            tasks.append({'file_path': file_path, 'rows': entry['rows'], 'bytes': entry['bytes'],
+                          'drop_path': f"{self.lsh_folder}/drop/{entry['index']}.bits",
+                          'offsets_path': self.store.segment_path(file_path, 'offsets'),
+                          'words_path': self.store.segment_path(file_path, 'words'),
+                          'shard_prefix': f"{out_folder}/{sub_folder_name}{entry['index']}",
+                          'shard_size': self.shard_size, 'compression': self.compression,
+                          'compression_level': self.compression_level})
+        shards = []
+        with Pool(processes=self.resources.rewrite_workers) as pool:
+            for file_shards in tqdm(pool.imap(rewrite_file, tasks), total=len(tasks), desc='preprocess_files'):
+                shards.extend(file_shards)
+        manifest = {'rows': sum(shard['rows'] for shard in shards),
+                    'words': sum(shard['words'] for shard in shards),
+                    'shards': shards}
+        with open(f'{out_folder}/manifest.json', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        return manifest
+
+    def preprocess_files(self, sub_folder_name: str, instrument=False):
         start_time = time.time()
+        self.instrumentation = Instrumentation() if instrument else None
+        if instrument:
+            self.instrumentation.source = source_group(sub_folder_name)
         data_dir = self.data_path + sub_folder_name
         all_files = get_all_files(data_dir)
         self.lsh_folder = f'./result/lsh/{sub_folder_name}'
@@ -187,28 +626,20 @@ class Deduplication:
         if not os.path.exists(res_folder):
             os.makedirs(res_folder)
         self.generate_pairs(all_files)
+        if self.index:
+            timed(self.instrumentation, 'index', self.build_index, n_bytes=0)
+        elif os.path.exists(f'{self.lsh_folder}/index'):
+            # the store of this run keeps no signatures, the index of an earlier run would read deleted segments
+            shutil.rmtree(f'{self.lsh_folder}/index')
         log_name = data_dir.split(self.data_path)[1]
         log_path = f'./result/logs/{log_name}.txt'
-        total_rows = 0
-        total_words = 0
-        idx = 0
         with open(log_path, 'a', encoding='utf-8') as log_file:
-            duplicates = self.generate_connected_components_mp(log_file)
-            for file_path in tqdm(all_files, desc='preprocess_files'):
-                res_path = f'{res_folder}/{sub_folder_name}/{sub_folder_name}{str(idx)}.jsonl'
-                if not os.path.exists(os.path.dirname(res_path)):
-                    os.makedirs(os.path.dirname(res_path))
-                with open(res_path, 'a', encoding='utf-8') as result_file:
-                    with open(file_path, 'r', encoding='utf-8') as fh:
-                        for line in fh:
-                            json_data = json.loads(line)
-                            if json_data['id'] not in duplicates[file_path]:
-                                json.dump(json_data, result_file, ensure_ascii=False)
-                                total_rows += 1
-                                total_words += len(json_data['text'].split())
-                                result_file.write('\n')
-                                if total_rows % 1000000 == 999999:
-                                    idx += 1
-            log_file.write(f"Number of words: {total_words}\n")
-            log_file.write(f"Filtered rows: {total_rows}\n")
+            self.generate_connected_components_mp(log_file)
+            manifest = timed(self.instrumentation, 'rewrite', self.rewrite_files, all_files, sub_folder_name,
+                             res_folder, n_bytes=sum(map(os.path.getsize, all_files)) if instrument else 0)
+            log_file.write(f"Number of words: {manifest['words']}\n")
+            log_file.write(f"Filtered rows: {manifest['rows']}\n")
             log_file.write(f"Deduplication Time: {time.time() - start_time:.3f}\n")
+        if instrument:
+            self.collect_instrumentation()
+            self.instrumentation.write(f'./result/logs/{log_name}.deduplication.json')
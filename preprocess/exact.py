@@ -0,0 +1,37 @@
+import hashlib
+
+import numpy as np
+
+# (128-bit text digest, order, document id) records of the exact duplicate shards. order is (path rank << 32 | row),
+# so the smallest order of a digest is the first occurrence of the text in (path, row) order, the document the
+# connected components keep
+RECORD = np.dtype([('hi', '<u8'), ('lo', '<u8'), ('order', '<u8'), ('doc', '<u8')])
+
+
+def text_digests(texts: list[str]):
+    # (n, 2) uint64 blake2b digests of the texts
+    raw = b''.join(hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest() for text in texts)
+    return np.frombuffer(raw, dtype=np.uint64).reshape(-1, 2)
+
+
+def write_shards(records: np.ndarray, shard_files: list):
+    # records are spread over the shards by their digest, so all copies of a text end up in the same shard
+    shards = records['hi'] % np.uint64(len(shard_files))
+    order = np.argsort(shards, kind='stable')
+    bounds = np.searchsorted(shards[order], np.arange(len(shard_files) + 1))
+    records = records[order]
+    for shard, f in enumerate(shard_files):
+        records[bounds[shard]:bounds[shard + 1]].tofile(f)
+
+
+def resolve_shard(shard_paths: list[str], pairs_path: str):
+    # pairs every later copy of a text with its first occurrence and returns the ids of the later copies
+    records = np.concatenate([np.fromfile(shard_path, dtype=RECORD) for shard_path in shard_paths] +
+                             [np.empty(0, dtype=RECORD)])
+    records = records[np.lexsort((records['order'], records['lo'], records['hi']))]
+    starts = np.ones(len(records), dtype=bool)
+    starts[1:] = (records['hi'][1:] != records['hi'][:-1]) | (records['lo'][1:] != records['lo'][:-1])
+    first = np.maximum.accumulate(np.where(starts, np.arange(len(records)), 0))
+    copies = ~starts
+    np.stack([records['doc'][copies], records['doc'][first[copies]]], axis=1).tofile(pairs_path)
+    return records['doc'][copies]
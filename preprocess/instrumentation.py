@@ -0,0 +1,102 @@
+import cProfile
+import json
+import os
+import time
+
+
+def source_group(source: str):
+    # 'socialMedia/telegram' -> 'socialMedia'
+    return source.split('/')[0] if source else ''
+
+
+def size_of(value):
+    # utf-8 bytes of a str, bytes or a list of them, 0 for anything else
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, list):
+        return sum(size_of(item) for item in value)
+    return 0
+
+
+def timed(instrumentation, stage: str, func, *args, n_bytes=None):
+    # calls func(*args), timed when instrumentation is on. Without n_bytes the size of the first argument is counted
+    if instrumentation is None:
+        return func(*args)
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    instrumentation.add(stage, seconds, size_of(args[0]) if n_bytes is None and args else n_bytes or 0)
+    return result
+
+
+class Instrumentation:
+    # accumulated seconds, calls and bytes per (source, stage). Workers send theirs to the parent which sums them
+    def __init__(self):
+        self.source = ''
+        self.stages = {}
+
+    def add(self, stage: str, seconds: float, n_bytes=0, calls=1):
+        entry = self.stages.setdefault((self.source, stage), [0.0, 0, 0])
+        entry[0] += seconds
+        entry[1] += calls
+        entry[2] += n_bytes
+
+    def __iadd__(self, other):
+        for key, (seconds, calls, n_bytes) in other.stages.items():
+            entry = self.stages.setdefault(key, [0.0, 0, 0])
+            entry[0] += seconds
+            entry[1] += calls
+            entry[2] += n_bytes
+        return self
+
+    def __bool__(self):
+        return bool(self.stages)
+
+    def to_dict(self):
+        # {source: {stage: {seconds, calls, bytes}}} plus the totals of every stage under 'all'
+        result = {}
+        for (source, stage), (seconds, calls, n_bytes) in sorted(self.stages.items()):
+            for group in [source, 'all']:
+                entry = result.setdefault(group, {}).setdefault(stage, {'seconds': 0.0, 'calls': 0, 'bytes': 0})
+                entry['seconds'] += seconds
+                entry['calls'] += calls
+                entry['bytes'] += n_bytes
+        return result
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        instrumentation = cls()
+        for source, stages in data.items():
+            if source == 'all':
+                continue
+            for stage, entry in stages.items():
+                instrumentation.stages[(source, stage)] = [entry['seconds'], entry['calls'], entry['bytes']]
+        return instrumentation
+
+    def write(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=1)
+
+
+class WorkerProfiler:
+    # cProfile of a single pool process: the first process to create the profile file keeps it
+    def __init__(self, path: str):
+        self.path = path
+        self.profile = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.close(os.open(f'{path}.lock', os.O_CREAT | os.O_EXCL))
+            self.profile = cProfile.Profile()
+        except FileExistsError:
+            pass
+
+    def run(self, func, *args):
+        if self.profile is None:
+            return func(*args)
+        result = self.profile.runcall(func, *args)
+        # pool processes are terminated, so the statistics are written after every task
+        self.profile.dump_stats(self.path)
+        return result
@@ -0,0 +1,82 @@
+import json
+import os
+
+import numpy as np
+
+from .minhash import SignatureEngine, band_keys
+from .signature_store import split_doc_ids
+
+
+def write_band(blocks, keys_path: str, docs_path: str):
+    # splits the sorted (band digest, document id) records of a band into a digest and a document id file, the
+    # digests are binary searched in place by LSHIndex
+    n_records = 0
+    with open(keys_path, 'wb') as keys, open(docs_path, 'wb') as docs:
+        for block in blocks:
+            np.ascontiguousarray(block['band']).tofile(keys)
+            np.ascontiguousarray(block['doc']).tofile(docs)
+            n_records += len(block)
+    return n_records
+
+
+def _map(path: str, dtype=np.uint64):
+    if not os.path.getsize(path):
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
+
+class LSHIndex:
+    # near duplicate lookups in the band index a Deduplication(index=True) run leaves in ./result/lsh/<subfolder>/
+    # index. A text is hashed like the corpus, its band digests are binary searched in the memory mapped digest
+    # files and the candidates get the share of equal MinHash values of the signature store as estimated Jaccard
+    def __init__(self, folder: str):
+        with open(f'{folder}/index.json', 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.config = meta['config']
+        self.n_signatures = meta['signatures']
+        self.files = {int(index): file_path for index, file_path in meta['files'].items()}
+        self.documents = meta['documents']
+        self.store_folder = meta['store']  # read only, the index is rebuilt with the store by every run
+        with open(f'{self.store_folder}/store.json', 'r', encoding='utf-8') as f:
+            if json.load(f)['config'] != self.config:
+                raise ValueError(f"the index in {folder} is older than its signature store, run "
+                                 f"Deduplication(index=True) again")
+        self.engine = SignatureEngine(num_perm=self.n_signatures, width=self.config['width'],
+                                      scheme=self.config['scheme'])
+        self.keys = [_map(f'{folder}/band{band_idx}.keys') for band_idx in range(self.config['band'])]
+        self.docs = [_map(f'{folder}/band{band_idx}.docs') for band_idx in range(self.config['band'])]
+        self.signatures = {}  # memory mapped signature segments of the files read so far
+
+    def file_signatures(self, file_index: int):
+        if file_index not in self.signatures:
+            self.signatures[file_index] = _map(f'{self.store_folder}/{file_index}.signatures',
+                                               np.uint32).reshape(-1, self.n_signatures)
+        return self.signatures[file_index]
+
+    def candidates(self, keys: np.ndarray):
+        # ids of the documents sharing at least one band with the band digests of one text, and how many they share
+        docs = [self.docs[band_idx][self.keys[band_idx].searchsorted(key, 'left'):
+                                    self.keys[band_idx].searchsorted(key, 'right')]
+                for band_idx, key in enumerate(keys)]
+        return np.unique(np.concatenate(docs + [np.empty(0, dtype=np.uint64)]), return_counts=True)
+
+    def query(self, text: str, threshold=0.0, limit=None):
+        return self.query_batch([text], threshold, limit)[0]
+
+    def query_batch(self, texts: list[str], threshold=0.0, limit=None):
+        # for every text the candidates with an estimated Jaccard of at least threshold, most similar first
+        signatures = self.engine.signatures(texts)
+        results = []
+        for signature, keys in zip(signatures, band_keys(signatures, self.config['band'], self.config['rows'])):
+            docs, n_bands = self.candidates(keys)
+            file_indices, rows = split_doc_ids(docs)
+            jaccard = np.empty(len(docs))
+            for file_index in np.unique(file_indices):
+                in_file = file_indices == file_index
+                jaccard[in_file] = (self.file_signatures(int(file_index))[rows[in_file].astype(np.int64)] ==
+                                    signature.astype(np.uint32)).mean(axis=1)
+            order = np.argsort(-jaccard, kind='stable')
+            order = order[jaccard[order] >= threshold][:limit]
+            results.append([{'doc': int(docs[i]), 'path': self.files[int(file_indices[i])], 'row': int(rows[i]),
+                             'bands': int(n_bands[i]), 'jaccard': float(jaccard[i])} for i in order])
+        return results
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import time
+from collections import Counter
+
+from .compression import READ_BLOCK
+
+# bump when a change of the normalization makes previous outputs stale
+NORMALIZATION_VERSION = 1
+# per file statistics kept in the manifest, the timing fields only describe the run that produced them
+STATS_KEYS = ['rows', 'words', 'filtered_rows', 'filtered_words', 'rejected', 'boilerplate_lines']
+
+
+def new_digest():
+    return hashlib.blake2b(digest_size=16)
+
+
+def combine_digests(digests: list[str]):
+    # digest of a file hashed in byte ranges, from the digests of its ranges in file order
+    if len(digests) == 1:
+        return digests[0]
+    return hashlib.blake2b(''.join(digests).encode('ascii'), digest_size=16).hexdigest()
+
+
+def range_digest(file_path: str, start=0, end=None):
+    digest = new_digest()
+    with open(file_path, 'rb') as fh:
+        fh.seek(start)
+        remaining = os.path.getsize(file_path) - start if end is None else end - start
+        for block in iter(lambda: fh.read(min(READ_BLOCK, remaining)), b''):
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+
+def file_digest(file_path: str, chunks=None):
+    # digest of the raw bytes, or of the (start, end) byte ranges of a file that is read in chunks. Workers hash
+    # the bytes they read, this reads the file again and is only used for files whose size or mtime changed
+    if chunks is None:
+        return range_digest(file_path)
+    return combine_digests([range_digest(file_path, start, end) for start, end in chunks])
+
+
+def file_state(file_path: str):
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def config_fingerprint(config: dict):
+    return hashlib.blake2b(json.dumps(config, sort_keys=True).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def write_json_atomic(data, path: str):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+class RunManifest:
+    # input file -> state, content digest, config fingerprint, output path and statistics of its last completed run.
+    # Saved at most every flush_interval seconds, so a crashed run only redoes the files completed since
+    def __init__(self, path: str, fingerprint: str, flush_interval=30):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.flush_interval = flush_interval
+        self.last_flush = time.time()
+        self.files = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.files = json.load(f)['files']
+            for entry in self.files.values():
+                entry['stats']['rejected'] = Counter(entry['stats']['rejected'])
+
+    def is_done(self, file_path: str, state: dict, digest=None):
+        # unchanged size and mtime, or the same content when a digest is given
+        entry = self.files.get(file_path)
+        if entry is None or entry['config'] != self.fingerprint or not os.path.exists(entry['output']):
+            return False
+        if digest is None:
+            return entry['state'] == state
+        return entry['hash'] == digest
+
+    def is_touched(self, file_path: str, state: dict):
+        # an up to date output but a new size or mtime, only then is the content hashed to tell a touched file from
+        # a changed one
+        entry = self.files.get(file_path)
+        return entry is not None and entry['state'] != state and self.is_done(file_path, entry['state'])
+
+    def prune(self, file_paths: list[str]):
+        file_paths = set(file_paths)
+        self.files = {file_path: entry for file_path, entry in self.files.items() if file_path in file_paths}
+
+    def record(self, file_path: str, state: dict, digest: str, output: str, stats: dict, sketch=None):
+        # sketch is the digest of the boilerplate frequencies the output was normalized with
+        self.files[file_path] = {'state': state, 'hash': digest, 'config': self.fingerprint, 'output': output,
+                                 'stats': {key: stats[key] for key in STATS_KEYS}, 'sketch': sketch}
+        if time.time() - self.last_flush > self.flush_interval:
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        write_json_atomic({'files': self.files}, self.path)
+        self.last_flush = time.time()
@@ -0,0 +1,120 @@
+import hashlib
+import re
+import string
+
+import numpy as np
+from datasketch import MinHash
+
+# same constants as datasketch.minhash, signatures of the 'sha1' scheme are bit-compatible with LeanMinHash
+_mersenne_prime = np.uint64((1 << 61) - 1)
+_max_hash = np.uint64((1 << 32) - 1)
+
+# version of each signature scheme, signatures of different schemes must never be compared
+SCHEMES = {'sha1': 1, 'rolling': 2}
+
+_persian_numbers_pattern = re.compile(f"({'|'.join(['یک', 'دو', 'سه', 'چهار', 'پنج', 'شش', 'هفت', 'هشت', 'نه', 'ده'])})")
+_punctuation_table = str.maketrans("", "", string.punctuation + "/:><؟!.،,?")
+_spaces_pattern = re.compile(r"\s+")
+
+_rolling_base = np.uint64(1000003)
+_rolling_mix = np.uint64(0x9E3779B97F4A7C15)
+
+
+def feature_text(s: str):
+    # lower cased
+    s = s.lower()
+    # digits are deliberately kept: get_features never applied this substitution and signatures stay compatible
+    s = s.replace('جمعه', '').replace('شنبه', '')
+    s = _persian_numbers_pattern.sub("", s)
+    # remove punctuation
+    s = s.translate(_punctuation_table)
+    # remove consecutive spaces, newlines, tabs in the middle and in the beginning / end
+    return _spaces_pattern.sub(" ", s.strip())
+
+
+def shingles(s: str, width: int):
+    return [s[i:i + width] for i in range(len(s) - width + 1)]
+
+
+class SignatureEngine:
+    def __init__(self, num_perm=128, width=13, scheme='sha1', max_rows=1 << 15):
+        if scheme not in SCHEMES:
+            raise ValueError(f"unknown signature scheme: {scheme}, expected one of {list(SCHEMES)}")
+        self.num_perm = num_perm
+        self.width = width
+        self.scheme = scheme
+        self.version = SCHEMES[scheme]
+        self.max_rows = max_rows  # shingles permuted at once, bounds the (rows, num_perm) temporary
+        self.a, self.b = MinHash(num_perm=num_perm).permutations
+
+    def shingle_hashes_sha1(self, texts: list[str]):
+        hashes = []
+        doc_ids = []
+        for doc_id, text in enumerate(texts):
+            doc_shingles = set(shingles(feature_text(text), self.width))
+            hashes.extend(int.from_bytes(hashlib.sha1(x.encode('utf8')).digest()[:4], 'little')
+                          for x in doc_shingles)
+            doc_ids.extend([doc_id] * len(doc_shingles))
+        return np.array(doc_ids, dtype=np.int64), np.array(hashes, dtype=np.uint64)
+
+    def shingle_hashes_rolling(self, texts: list[str]):
+        # all documents of the batch are encoded as one UTF-32 code point array, windows crossing a
+        # document boundary are masked out
+        cleaned = [feature_text(text) for text in texts]
+        lengths = np.array([len(text) for text in cleaned], dtype=np.int64)
+        code_points = np.frombuffer(''.join(cleaned).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+        n_windows = len(code_points) - self.width + 1
+        if n_windows <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint64)
+        rolling = np.zeros(n_windows, dtype=np.uint64)
+        for j in range(self.width):
+            rolling = rolling * _rolling_base + code_points[j:j + n_windows]
+        ends = np.cumsum(lengths)
+        window_doc = np.repeat(np.arange(len(texts)), lengths)[:n_windows]
+        valid = np.arange(n_windows) + self.width <= ends[window_doc]
+        window_doc = window_doc[valid]
+        hashes = ((rolling[valid] * _rolling_mix) >> np.uint64(32)) & _max_hash
+        # drop repeated shingles of a document, the minimum is unaffected
+        keys = np.unique((window_doc.astype(np.uint64) << np.uint64(32)) | hashes)
+        return (keys >> np.uint64(32)).astype(np.int64), keys & _max_hash
+
+    def signatures(self, texts: list[str]):
+        if self.scheme == 'sha1':
+            doc_ids, hashes = self.shingle_hashes_sha1(texts)
+        else:
+            doc_ids, hashes = self.shingle_hashes_rolling(texts)
+        signatures = np.full((len(texts), self.num_perm), _max_hash, dtype=np.uint64)
+        start = 0
+        while start < len(hashes):
+            end = min(start + self.max_rows, len(hashes))
+            if end < len(hashes):
+                # never split a document across two chunks
+                end = np.searchsorted(doc_ids, doc_ids[end], side='left')
+                if end == start:
+                    end = np.searchsorted(doc_ids, doc_ids[start], side='right')
+            chunk_docs = doc_ids[start:end]
+            # (a * hv + b) % prime & max_hash for every permutation at once, laid out as (num_perm, rows)
+            phv = np.multiply.outer(self.a, hashes[start:end])
+            phv += self.b[:, None]
+            # x % (2^61 - 1) without a division: fold the top 3 bits back in, then subtract once
+            high_bits = phv >> np.uint64(61)
+            phv &= _mersenne_prime
+            phv += high_bits
+            np.subtract(phv, _mersenne_prime, out=phv, where=phv >= _mersenne_prime)
+            phv &= _max_hash
+            boundaries = np.flatnonzero(np.r_[True, chunk_docs[1:] != chunk_docs[:-1]])
+            signatures[chunk_docs[boundaries]] = np.minimum.reduceat(phv, boundaries, axis=1).T
+            start = end
+        return signatures
+
+
+def _band_key(h_bytes):
+    # 64-bit digest of a band, this is what the signature store keeps and what the buckets are keyed by
+    return int.from_bytes(hashlib.blake2b(h_bytes, digest_size=8).digest(), 'big')
+
+
+def band_keys(signatures: np.ndarray, band: int, rows: int):
+    # bands are hashed as the byte-swapped slices of the LeanMinHash hash values
+    swapped = signatures.byteswap()
+    return np.array([[_band_key(hashvalues[i * rows: (i + 1) * rows].tobytes())
+                      for i in range(band)] for hashvalues in swapped], dtype=np.uint64).reshape(-1, band)
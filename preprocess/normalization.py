@@ -0,0 +1,65 @@
+import re
+import sys
+
+wierd_chars = (u"\U0001F600-\U0001F64F"  # emoticons
+               u"\U0001F300-\U0001F5FF"  # symbols & pictographs
+               u"\U0001F680-\U0001F6FF"  # transport & map symbols
+               u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
+               u"\U00002702-\U000027B0"
+               u"\U000024C2-\U0001F251"
+               u"\U0001f926-\U0001f937"
+               u'\U00010000-\U0010ffff'
+               u"\u200d"
+               u"\u2640-\u2642"
+               u"\u2600-\u2b55"
+               u"\u23cf"
+               u"\u23e9"
+               u"\u231a"
+               u"\u3030"
+               u"\ufe0f"
+               u"\u2069"
+               u"\u2066"
+               # u"\u200c"
+               u"\u2068"
+               u"\u2067"
+               u"\u0640")
+pdf_chars = "\u200e\u200f\u202a\u202b\u202f\u202d\u202e"
+# characters str.splitlines breaks on, document level patterns never match them so lines stay apart
+line_breaks = "\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+numbers_punctuation = '=+؛٪:><؟!.،,?!%;:¥-()[]{}$@#^&*۰۱۲۳۴۵۶۷۸۹"\''
+
+
+class NormalizationEngine:
+    # character level cleaning of preprocess_line, compiled once. Html tags, emojis and PDF direction marks are
+    # all deleted, so the three passes are fused into one alternation. The same steps run on whole documents
+    # with patterns that never cross a line break, which gives the same lines as running them line by line
+    def __init__(self):
+        self.empty_lines = re.compile(r'\n\s*\t*\n*')
+        self.style_tags = re.compile(r'<style.*?</style>', flags=re.DOTALL)
+        self.escaped_newlines = re.compile(r'\\+n')
+        self.escaped_tabs = re.compile(r'\\+t')
+        self.dot_letter = re.compile(r'\.\s([a-zA-Z])')
+        self.document_dot_letter = re.compile(rf'\.[^\S{line_breaks}]([a-zA-Z])')
+        self.upper_words = re.compile(r'\b[A-Z]+\b')
+        self.deletions = re.compile(f'<[^>]+>|[{wierd_chars}{pdf_chars}]+')
+        self.document_deletions = re.compile(f'<[^>{line_breaks}]+>|[{wierd_chars}{pdf_chars}]+')
+        self.repeated_chars = re.compile(r"(.)\1{2,}")
+        digits = ''.join(char for char in map(chr, range(sys.maxunicode + 1)) if char.isdigit())
+        self.numbers_punctuation_table = str.maketrans("", "", digits + numbers_punctuation)
+
+    def clean_line(self, text: str):
+        text = self.dot_letter.sub(r'.\1', text)
+        text = self.upper_words.sub('', text)
+        return self.deletions.sub('', text)  # removing html tags, unicodes and PDF special characters
+
+    def clean_document(self, text: str):
+        text = self.document_dot_letter.sub(r'.\1', text)
+        text = self.upper_words.sub('', text)
+        return self.document_deletions.sub('', text)
+
+    def line_rules(self, text: str):
+        text = self.repeated_chars.sub(r"\1\1", text)  # Deleting repeated chars
+        return text.replace('ه . ش', 'ه.ش').replace('ه . ق', 'ه.ق')  # ه.ش و ه.ق
+
+    def count_numbers_punctuation(self, text: str):
+        return len(text) - len(text.translate(self.numbers_punctuation_table))
@@ -1,4 +1,5 @@
 from collections import defaultdict, Counter
+from multiprocessing import Pool
 import pathlib
 from tqdm import tqdm
 import os
@@ -6,9 +7,19 @@ import json
 import re
 
 hashtag_pattern = r'#(\w+)'
+# a '#' and the word characters after it, every hashtag found in a text is a prefix of one of these runs
+hashtag_run_pattern = re.compile(r'#\w*')
 hashtag_counts = {}
 
 
+def n_workers(n_processes=None):
+    # pool size of the scripts run from preprocess/others, which can not import the package's Resources: the given
+    # one, else HODHOD_TOOL_WORKERS, else all cores
+    n_processes = n_processes or int(os.environ.get('HODHOD_TOOL_WORKERS', 0)) or os.cpu_count()
+    print(f"using {n_processes} processes")
+    return n_processes
+
+
 def get_all_files(data_dir: str):
     all_files = []
     for subdir, dirs, files in os.walk(data_dir):
@@ -18,24 +29,69 @@ def get_all_files(data_dir: str):
     return all_files
 
 
+def read_tweets(file_path: str):
+    file_type = os.path.splitext(file_path)[-1]
+    with open(file_path, 'r', encoding='utf-8') as fh:
+        if file_type == '.json':
+            try:
+                return json.load(fh)
+            except json.decoder.JSONDecodeError:
+                print("Error in reading file: ", file_path)
+    return []
+
+
+class HashtagMatcher:
+    # the hashtags of a list that occur in a tweet, in one pass over the tweet. Hashtags are '#' followed by word
+    # characters, so '#ab' occurs in a tweet exactly when it is a prefix of one of its '#' runs ('#abc'); the
+    # prefixes of every run are looked up in a dict of the hashtags instead of searching every hashtag
+    def __init__(self, hashtags: list[str]):
+        self.ranks = {}
+        for hashtag in hashtags:
+            self.ranks.setdefault(hashtag, len(self.ranks))
+        self.lengths = sorted({len(hashtag) for hashtag in self.ranks})
+
+    def find(self, tweet: str):
+        # in the order of the hashtag list
+        matches = set()
+        for run in hashtag_run_pattern.findall(tweet):
+            for length in self.lengths:
+                if length > len(run):
+                    break
+                if run[:length] in self.ranks:
+                    matches.add(run[:length])
+        return sorted(matches, key=self.ranks.get)
+
+
+# state of the pool processes, set once by init_worker
+_matcher = None
+_stop_words = None
+_hashtag_keywords = None
+
+
+def init_worker(hashtags, stop_words, hashtag_keywords):
+    global _matcher, _stop_words, _hashtag_keywords
+    _matcher = HashtagMatcher(hashtags) if hashtags is not None else None
+    _stop_words = stop_words
+    _hashtag_keywords = hashtag_keywords
+
+
+def count_hashtags(file_path: str):
+    counts = Counter()
+    for json_data in read_tweets(file_path):
+        counts.update(re.findall(hashtag_pattern, json_data['text']))
+    return counts
+
+
 def get_hashtags(sub_folder_name: str):
     if not os.path.exists('../../result/hashtags'):
         os.makedirs('../../result/hashtags')
     data_dir = '../../data/' + sub_folder_name
     all_files = get_all_files(data_dir)
-    hashtag_counts = {}
-    for file_path in tqdm(all_files, desc="counting"):
-        file_type = os.path.splitext(file_path)[-1]
-        with open(file_path, 'r', encoding='utf-8') as fh:
-            if file_type == '.json':
-                try:
-                    json_datas = json.load(fh)
-                    for i, json_data in enumerate(json_datas):
-                        hashtags = re.findall(hashtag_pattern, json_data['text'])
-                        for hashtag in hashtags:
-                            hashtag_counts[hashtag] = hashtag_counts.get(hashtag, 0) + 1
-                except json.decoder.JSONDecodeError:
-                    print("Error in reading file: ", file_path)
+    hashtag_counts = Counter()
+    # files are merged in order, ties keep the order of their first occurrence
+    with Pool(n_workers()) as pool:
+        for counts in tqdm(pool.imap(count_hashtags, all_files), total=len(all_files), desc="counting"):
+            hashtag_counts.update(counts)
 
     hashtag_counts = sorted(hashtag_counts.items(), key=lambda x: -x[1])
     with open(f'../../result/hashtags/hashtags_{sub_folder_name}.txt', 'w', encoding='utf-8') as f:
@@ -49,33 +105,36 @@ def extract_keywords(tweet, stopwords):
     return keywords
 
 
+def count_keywords(file_path: str):
+    # keyword counts of every hashtag in the tweets of one file
+    hashtags_keywords = defaultdict(Counter)
+    for json_data in read_tweets(file_path):
+        tweet = json_data['text']
+        matches = _matcher.find(tweet)
+        if matches:
+            keywords = Counter(extract_keywords(tweet, _stop_words))
+            for hashtag in matches:
+                hashtags_keywords[hashtag].update(keywords)
+    return hashtags_keywords
+
+
 def get_keywords(sub_folder_name: str):
     with open(f'../../result/hashtags/hashtags_{sub_folder_name}.txt', 'r', encoding='utf-8') as file:
         lines = file.readlines()
     with open(f'./stopwords.txt', 'r', encoding='utf-8') as file:
-        stop_words = [elem.strip() for elem in file.readlines()]
+        stop_words = {elem.strip() for elem in file.readlines()}
     hashtags = ['#' + line.strip().split(':')[0] for line in lines]
     data_dir = '../../data/' + sub_folder_name
     all_files = get_all_files(data_dir)
-    hashtags_keywords = defaultdict(list)
-    for file_path in tqdm(all_files, desc="counting_keywords"):
-        file_type = os.path.splitext(file_path)[-1]
-        with open(file_path, 'r', encoding='utf-8') as fh:
-            if file_type == '.json':
-                try:
-                    json_datas = json.load(fh)
-                    for i, json_data in enumerate(json_datas):
-                        tweet = json_data['text']
-                        for hashtag in hashtags:
-                            if hashtag in tweet:
-                                keywords = extract_keywords(tweet, stop_words)
-                                hashtags_keywords[hashtag].extend(keywords)
-                except json.decoder.JSONDecodeError:
-                    print("Error in reading file: ", file_path)
+    hashtags_keywords = defaultdict(Counter)
+    with Pool(n_workers(), initializer=init_worker, initargs=(hashtags, stop_words, None)) as pool:
+        for file_keywords in tqdm(pool.imap(count_keywords, all_files), total=len(all_files),
+                                  desc="counting_keywords"):
+            for hashtag, keyword_counts in file_keywords.items():
+                hashtags_keywords[hashtag].update(keyword_counts)
 
     result_json = {}
-    for hashtag, keywords in hashtags_keywords.items():
-        keyword_counts = Counter(keywords)
+    for hashtag, keyword_counts in hashtags_keywords.items():
         top_keywords = keyword_counts.most_common(200)
         result_json[hashtag] = [{"keyword": key, "count": count} for key, count in top_keywords if key != hashtag]
 
@@ -83,47 +142,51 @@ def get_keywords(sub_folder_name: str):
         json.dump(result_json, output_file, ensure_ascii=False, indent=4)
 
 
+def keyword_sets(hashtag_keywords: dict):
+    return {hashtag: {elem['keyword'] for elem in keywords} for hashtag, keywords in hashtag_keywords.items()}
+
+
 def remove_irrelevant_hashtags(tweet, hashtag_keywords):
+    # hashtag_keywords maps every hashtag to the set of its keywords, see keyword_sets
     words = tweet.split()
     hashtags = []
     while len(words) > 0 and words[-1].startswith("#"):
         hashtags.append(words.pop())
+    word_set = set(words)
     # Check if the last word is a hashtag
     for hashtag in hashtags:
-        keyword_count = 0
         if hashtag in hashtag_keywords:
-            keywords = [elem['keyword'] for elem in hashtag_keywords[hashtag]]
-            for keyword in keywords:
-                if keyword in words:
-                    keyword_count += 1
-
-            if keyword_count >= 3:
+            if len(hashtag_keywords[hashtag] & word_set) >= 3:
                 words.append(hashtag)
+                word_set.add(hashtag)
             else:
                 print(f"Removing hashtag: {hashtag} from tweet: {tweet}")
     updated_tweet = " ".join(words)
     return updated_tweet
 
 
+def remove_file_hashtags(file_path: str):
+    lines = []
+    for json_data in read_tweets(file_path):
+        json_data['text'] = remove_irrelevant_hashtags(json_data['text'], _hashtag_keywords)
+        if len(json_data['text'].split()) > 0:
+            lines.append(json.dumps(json_data, ensure_ascii=False) + '\n')
+    return lines
+
+
 def remove_hashtags(sub_folder_name: str):
     data_dir = '../../data/' + sub_folder_name
     all_files = get_all_files(data_dir)
     with open(f'../../result/hashtags/hashtags_dict_{sub_folder_name}.json', 'r', encoding='utf-8') as output_file:
-        hashtag_keywords = json.load(output_file)
+        hashtag_keywords = keyword_sets(json.load(output_file))
     with open(f'../../data/{sub_folder_name}/{sub_folder_name}.jsonl', 'w', encoding='utf-8') as f:
-        for file_path in tqdm(all_files, desc="counting"):
-            file_type = os.path.splitext(file_path)[-1]
-            with open(file_path, 'r', encoding='utf-8') as fh:
-                if file_type == '.json':
-                    try:
-                        json_datas = json.load(fh)
-                        for i, json_data in enumerate(json_datas):
-                            json_data['text'] = remove_irrelevant_hashtags(json_data['text'], hashtag_keywords)
-                            if len(json_data['text'].split() > 0):
-                                json.dump(json_data, f, ensure_ascii=False)
-                                f.write('\n')
-                    except json.decoder.JSONDecodeError:
-                        print("Error in reading file: ", file_path)
+        with Pool(n_workers(), initializer=init_worker,
+                  initargs=(None, None, hashtag_keywords)) as pool:
+            for lines in tqdm(pool.imap(remove_file_hashtags, all_files), total=len(all_files), desc="counting"):
+                f.writelines(lines)
+            # workers that exit on their own flush the removal messages they printed, terminated ones do not
+            pool.close()
+            pool.join()
 
 
 if __name__ == '__main__':
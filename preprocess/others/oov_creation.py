@@ -6,11 +6,13 @@ from multiprocessing import Pool
 import pandas as pd
 from tqdm import tqdm
 
+from hashtags import n_workers
+
 tqdm.pandas()
 
 
-def imap_unordered_bar(func, args, n_processes=72):
-    p = Pool(n_processes)
+def imap_unordered_bar(func, args, n_processes=None):
+    p = Pool(n_workers(n_processes))
     res_list = []
     with tqdm(total=len(args)) as pbar:
         for i, res in enumerate(p.imap_unordered(func, args)):
@@ -1,13 +1,11 @@
-import csv
 import json
 import os
-import re
-import string
+import shutil
 import time
 from collections import Counter
-from multiprocessing import Pool, cpu_count
+from multiprocessing import Pool
 
-import pandas as pd
+import numpy as np
 from piraye import NormalizerBuilder
 from piraye.tasks.normalizer.normalizer_builder import Config
 from piraye.tasks.tokenizer.nltk_tokenizer import NltkTokenizer
@@ -15,48 +13,88 @@ from spacy.lang.en import English
 from tqdm import tqdm
 from transformers import AutoTokenizer
 
+from .boilerplate import CountMinSketch, key_hashes, line_hashes, line_key
+from .chunking import count_lines, iter_lines, merge_parts, part_path, plan_chunks
+from .compression import HashingReader, open_file, output_suffix, split_suffix, strip_suffix
+from .instrumentation import Instrumentation, WorkerProfiler, source_group, timed
+from .manifest import (NORMALIZATION_VERSION, RunManifest, combine_digests, config_fingerprint, file_digest,
+                       file_state, new_digest)
+from .normalization import NormalizationEngine
+from .quality import QualityFilter
+from .readers import iter_rows
+from .resources import Resources
+from .token_ratio import TokenRatioScorer
 from .utils import get_all_files
 
-wierd_pattern = re.compile("["
-                           u"\U0001F600-\U0001F64F"  # emoticons
-                           u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-                           u"\U0001F680-\U0001F6FF"  # transport & map symbols
-                           u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
-                           u"\U00002702-\U000027B0"
-                           u"\U000024C2-\U0001F251"
-                           u"\U0001f926-\U0001f937"
-                           u'\U00010000-\U0010ffff'
-                           u"\u200d"
-                           u"\u2640-\u2642"
-                           u"\u2600-\u2B55"
-                           u"\u23cf"
-                           u"\u23e9"
-                           u"\u231a"
-                           u"\u3030"
-                           u"\ufe0f"
-                           u"\u2069"
-                           u"\u2066"
-                           # u"\u200c"
-                           u"\u2068"
-                           u"\u2067"
-                           u"\u0640"
-                           "]+", flags=re.UNICODE)
+
+def new_stats():
+    return {'rows': 0, 'words': 0, 'filtered_rows': 0, 'filtered_words': 0, 'rejected': Counter(), 'tasks': 0,
+            'seconds': 0.0, 'startup': 0.0, 'boilerplate_lines': 0, 'instrumentation': Instrumentation()}
+
+
+def merge_stats(total: dict, stats: dict):
+    for key, value in stats.items():
+        total[key] += value
+
+
+# the Preprocessor of a pool process, built once by init_worker from the picklable worker_config of the parent
+_preprocessor = None
+_startup = 0.0
+_profiler = None
+
+
+def init_worker(config: dict):
+    global _preprocessor, _startup, _profiler
+    start_time = time.time()
+    _preprocessor = Preprocessor(**config['kwargs'])
+    for name, value in {**config['attributes'], **config['runtime']}.items():
+        setattr(_preprocessor, name, value)
+    if _preprocessor.profile_path:
+        _profiler = WorkerProfiler(_preprocessor.profile_path)
+    _startup = time.time() - start_time
+
+
+def normalize_task(task):
+    global _startup
+    start_time = time.time()
+    if _profiler is not None:
+        stats = _profiler.run(_preprocessor.preprocess_file, *task)
+    else:
+        stats = _preprocessor.preprocess_file(*task)
+    stats['tasks'] = 1
+    stats['seconds'] = time.time() - start_time
+    # the startup time of a process is reported with its first task
+    stats['startup'], _startup = _startup, 0.0
+    return task, stats
+
+
+def boilerplate_task(task):
+    return _preprocessor.boilerplate_counts(*task)
 
 
 class Preprocessor:
     def __init__(self, token_ratio_quality=False, threshold=100, char_threshold=35, min_threshold=50,
-                 line_threshold=20, number_threshold=0.2):
+                 line_threshold=20, number_threshold=0.2, prefilter=False, prefilter_margin=0.5, compression=None,
+                 compression_level=None, boilerplate_threshold=0, resources=None):
+        self.config = {'token_ratio_quality': token_ratio_quality, 'threshold': threshold,
+                       'char_threshold': char_threshold, 'min_threshold': min_threshold,
+                       'line_threshold': line_threshold, 'number_threshold': number_threshold,
+                       'prefilter': prefilter, 'prefilter_margin': prefilter_margin, 'compression': compression,
+                       'compression_level': compression_level, 'boilerplate_threshold': boilerplate_threshold}
         self.log_path = None
+        self.manifest_path = None
         self.normalizer = NormalizerBuilder(
             [Config.PUNCTUATION_FA, Config.ALPHABET_FA, Config.DIGIT_FA, Config.ALPHABET_EN, Config.DIGIT_EN,
              Config.DIGIT_FA, Config.DIACRITIC_DELETE, Config.SPACE_KEEP, Config.PUNCTUATION_FA,
              Config.PUNCTUATION_EN],
             remove_extra_spaces=True,
             tokenization=True).build()
+        self.engine = NormalizationEngine()
         self.tokenizer = NltkTokenizer()
         self.nlp = English()
         self.spacy_tokenizer = self.nlp.tokenizer
         self.nlp.max_length = 15000000
+        self.spacy_batch_size = 1000
         self.data_path = "data/"
 
         self.threshold = threshold
@@ -68,7 +106,10 @@ class Preprocessor:
         self.number_of_filtered_rows = 0
         self.filtering = True
         self.number_threshold = number_threshold
-        csv.field_size_limit(1000000000)
+        self.chunk_size = 1 << 28  # bytes, larger jsonl files are normalized in parallel chunks
+        self.read_block_size = 1 << 26  # bytes of a csv block, the longest csv row must fit in it
+        self.compression = compression  # codec of the normalized files, None, 'gzip' or 'zstd'
+        self.compression_level = compression_level
         self.token_ratio_quality = token_ratio_quality
         if token_ratio_quality:
             self.base_model_id = 'FacebookAI/xlm-roberta-large'
@@ -81,102 +122,151 @@ class Preprocessor:
                 padding=False,
                 truncation=False,
             )
+        self.quality_filter = QualityFilter(threshold, char_threshold, min_threshold, line_threshold,
+                                            prefilter_margin=prefilter_margin)
+        # documents that passed every other check wait here and are scored by the tokenizer in batches
+        self.token_ratio_scorer = TokenRatioScorer(self.bert_tokenizer) if token_ratio_quality else None
+        self.token_ratio_buffer = 512
+        self.token_ratio_pending = []
+        self.prefilter = prefilter  # drop clearly rejected documents before the normalization
+        self.instrument = False  # time, calls and bytes of every stage per source, see instrumentation.py
+        self.instrumentation = None
+        self.profile_path = None  # cProfile output of one pool process
+        # lines found in at least boilerplate_threshold documents of their source are removed, 0 keeps every line
+        self.boilerplate_threshold = boilerplate_threshold
+        self.boilerplate_path = None  # count-min sketches of the line frequencies of every source
+        self.sketches = {}
+        self.boilerplate_lines = 0
+        self.resources = resources or Resources.load()  # processes per stage, see resources.py
 
     def custom_tokenize(self, text):
-        doc = self.nlp(text)
-        tokens = []
-        is_hashtag = False
-        for token in doc:
-            if token.text == "#":
-                is_hashtag = True
-            else:
-                cr_text = ''
-                if is_hashtag:
-                    cr_text += '#'
-                cr_text += token.text
-                tokens.append(cr_text)
-                is_hashtag = False
-        return tokens
-
-    def get_features(self, s: str):
-        s = s.lower()
-        s = s.translate(str.maketrans("", "", string.punctuation))
-        s = s.translate(str.maketrans("", "", ":><؟!.،,?..,?!%;:-()[]{}$@#^&*"))
-        s = re.sub(r"\s+", " ", s.strip())
-        return len(s.split()) > self.threshold, s
-
-    def is_persian_text(self, text):
-        persian_chars = sum(1 for char in text if '\u0600' <= char <= '\u06FF')
-        total_chars = len(text)
-        percentage = (persian_chars / total_chars) * 100 if total_chars > 0 else 0
-        return percentage > self.char_threshold
+        return self.tokenize_sentences([text])[0]
+
+    def tokenize_sentences(self, sentences: list[str]):
+        # only the tokenizer of the blank English pipeline runs, a '#' token is glued to the token after it.
+        # The merge crosses spaces and punctuation splits, so it can not be a tokenizer special case
+        tokenized = []
+        for sentence, doc in zip(sentences, self.spacy_tokenizer.pipe(sentences, batch_size=self.spacy_batch_size)):
+            if '#' not in sentence:
+                tokenized.append([token.text for token in doc])
+                continue
+            tokens = []
+            is_hashtag = False
+            for token in doc:
+                if token.text == "#":
+                    is_hashtag = True
+                else:
+                    cr_text = ''
+                    if is_hashtag:
+                        cr_text += '#'
+                    cr_text += token.text
+                    tokens.append(cr_text)
+                    is_hashtag = False
+            tokenized.append(tokens)
+        return tokenized
 
     def token_ratio_quality_assessment(self, text, filter_th=3):
-        tokens = len(self.bert_tokenizer.tokenize(text))
-        text_len = len(text)
-        if text_len / tokens >= filter_th:
-            return True
-        else:
-            return False
-
-    def most_repeated_word_over_threshold(self, text):
-        # Tokenize the text into words
-        words = re.findall(r'\b\w+\b', text)
-        # Count the frequency of each word
-        word_counts = Counter(words)
-        if not word_counts:
-            return False
-        # Find the word with the maximum frequency
-        most_common_word, max_count = word_counts.most_common(1)[0]
-        # Calculate the percentage of the text occupied by this word
-        percentage = (max_count / len(words)) * 100
-        return percentage < self.min_threshold
-
-    def check_short_lines(self, text):
-        lines = text.split('\n')
-        short_line_count = sum(1 for line in lines if len(line.split()) < self.line_threshold)
-        total_line_count = len(lines)
-        portion_short_lines = (short_line_count / total_line_count) * 100
-        return portion_short_lines < self.min_threshold
+        return TokenRatioScorer(self.bert_tokenizer, filter_th).assess([text])[0]
 
     def check_count_numbers_line(self, line):
-        num_punct_count = sum(
-            1 for char in line if char.isdigit() or char in '=+؛٪:><؟!.،,?!%;:¥-()[]{}$@#^&*۰۱۲۳۴۵۶۷۸۹"\'')
+        num_punct_count = self.engine.count_numbers_punctuation(line)
         total_chars = len(line)
         if num_punct_count / total_chars >= self.number_threshold:
             return ""
         else:
             return line
 
-    def preprocess_line(self, text: str, source: str):
-        text = re.sub(r'\.\s([a-zA-Z])', r'.\1', text)
-        text = re.sub(r'\b[A-Z]+\b', '', text)
-        text = re.sub(r'<[^>]+>', '', text)  # removing html tags
-        text = wierd_pattern.sub(r'', text)  # Deleting unicodes
-        if 'socialMedia' in source:
-            re.sub(r"https://t\.me/[\w/]+", '', text)
-            re.sub(r"eitta\.me/[\w/]+", '', text)
-        text = text.translate(str.maketrans("", "", "‎‏‪‫ ‭‮"))  # Deleting PDF special characters
-        text = self.normalizer.normalize(text)
-        text = re.sub(r"(.)\1{2,}", r"\1\1", text)  # Deleting repeated chars
-        text = text.replace('ه . ش', 'ه.ش').replace('ه . ق', 'ه.ق')  # ه.ش و ه.ق
+    def normalize_line(self, text: str, source: str, instrumentation=None):
+        text = timed(instrumentation, 'piraye', self.normalizer.normalize, text)
+        text = timed(instrumentation, 'line_regex', self.engine.line_rules, text)
         if 'paper' in source:
-            text = self.check_count_numbers_line(text)
-        sents = [sen for sen in self.tokenizer.sentence_tokenize(text)]
-        list_of_sentences = [[str(token) for token in self.custom_tokenize(sen)] for sen in sents]
-        tokens = [item for sublist in list_of_sentences for item in sublist]
-        text = ' '.join(tokens)
-        return text.strip()
+            text = timed(instrumentation, 'numbers', self.check_count_numbers_line, text)
+        return text
+
+    def tokenize_lines(self, lines: list[str], instrumentation=None):
+        # sentences of all lines go through the spaCy tokenizer as one batch
+        sents = [timed(instrumentation, 'sentences', self.tokenizer.sentence_tokenize, line) for line in lines]
+        tokenized = iter(timed(instrumentation, 'spacy', self.tokenize_sentences,
+                               [sen for line in sents for sen in line]))
+        return [' '.join(token for _ in line for token in next(tokenized)).strip() for line in sents]
 
-    def preprocess_document(self, text: str, source: str):
-        text = re.sub(r'\n\s*\t*\n*', '\n', text)
-        text = re.sub(r'<style.*?</style>', '', text, flags=re.DOTALL)  # delete css tags
+    def preprocess_line(self, text: str, source: str, instrumentation=None):
+        text = timed(instrumentation, 'regex', self.engine.clean_line, text)
+        text = self.normalize_line(text, source, instrumentation)
+        return self.tokenize_lines([text], instrumentation)[0]
+
+    def split_lines(self, text: str, source: str):
+        text = self.engine.empty_lines.sub('\n', text)
+        text = self.engine.style_tags.sub('', text)  # delete css tags
         if 'madlad' in source:
             text = text.replace('/n', '\n').replace('n\\', '\n').replace('\\n', '\n')
-            text = re.sub(r'\\+n', r'\n', text)
-            text = re.sub(r'\\+t', r'\t', text)
-        lines = text.splitlines()
-        lines = ([self.preprocess_line(text_line, source) for text_line in lines])
+            text = self.engine.escaped_newlines.sub(r'\n', text)
+            text = self.engine.escaped_tabs.sub(r'\t', text)
+        # the character level cleaning of preprocess_line runs once on the whole document
+        return self.engine.clean_document(text).splitlines()
+
+    def preprocess_document(self, text: str, source: str, instrumentation=None):
+        lines = timed(instrumentation, 'regex', self.split_lines, text, source)
+        if self.boilerplate_threshold:
+            lines = timed(instrumentation, 'boilerplate', self.drop_boilerplate, lines, source)
+        lines = [self.normalize_line(text_line, source, instrumentation) for text_line in lines]
+        lines = self.tokenize_lines(lines, instrumentation)
+        return timed(instrumentation, 'source_rules', self.apply_source_rules, lines, source)
+
+    def boilerplate_sketch(self, source: str):
+        if source not in self.sketches:
+            sketch_path = f'{self.boilerplate_path}/{source}.npy'
+            self.sketches[source] = CountMinSketch.load(sketch_path) if os.path.exists(sketch_path) else None
+        return self.sketches[source]
+
+    def drop_boilerplate(self, lines: list[str], source: str):
+        sketch = self.boilerplate_sketch(source)
+        if sketch is None or not lines:
+            return lines
+        keys = [line_key(line) for line in lines]
+        counts = sketch.query(key_hashes(keys)).tolist()
+        kept = [line for line, key, count in zip(lines, keys, counts) if not key or count < self.boilerplate_threshold]
+        self.boilerplate_lines += len(lines) - len(kept)
+        return kept
+
+    def boilerplate_counts(self, file_path: str, chunk=None):
+        # first pass: hashes of the distinct lines of every document of a jsonl file or chunk, with their counts
+        source = self.output_path(file_path)[0]
+        start, end = chunk[:2] if chunk else (0, os.path.getsize(file_path))
+        hashes = [np.empty(0, dtype=np.uint64)]
+        for line in iter_lines(file_path, start, end):
+            try:
+                text = json.loads(line).get('text')
+            except json.decoder.JSONDecodeError:
+                continue
+            if isinstance(text, str):
+                hashes.append(line_hashes(self.split_lines(text, source)))
+        return source, *np.unique(np.concatenate(hashes), return_counts=True)
+
+    def count_boilerplate(self, all_files: list[str], pool):
+        # line frequencies of every source in a count-min sketch, returns the digest of the sketch of every source.
+        # Tasks are ordered by source, so the parent only holds the sketch of one source at a time
+        if os.path.exists(self.boilerplate_path):
+            shutil.rmtree(self.boilerplate_path)
+        tasks = self.plan_tasks([file_path for file_path in all_files if split_suffix(file_path)[0] == '.jsonl'],
+                                pool)[0]
+        tasks.sort(key=lambda task: self.output_path(task[0])[0])
+        digests = {}
+        source, sketch = None, None
+        for task_source, hashes, counts in tqdm(pool.imap(boilerplate_task, tasks), total=len(tasks),
+                                                desc='boilerplate'):
+            if task_source != source:
+                if sketch is not None:
+                    sketch.save(f'{self.boilerplate_path}/{source}.npy')
+                    digests[source] = sketch.digest()
+                source, sketch = task_source, CountMinSketch()
+            sketch.add(hashes, counts)
+        if sketch is not None:
+            sketch.save(f'{self.boilerplate_path}/{source}.npy')
+            digests[source] = sketch.digest()
+        return digests
+
+    def apply_source_rules(self, lines: list[str], source: str):
         if 'baznashr' in source:
             delete_list = ['انتهای پیام', 'نظرات کاربران', 'به این مطلب امتیاز دهید', 'تبادل نظر کنید', 'بیشتر بخوانید',
                            'اعتمادآنلاین', 'پایان پیام ', 'گفتگو با شبکه تلویزیونی سی بی اس آمریکا']
@@ -199,176 +289,268 @@ class Preprocessor:
                 else:
                     lines[len(lines) - i - 1] = ''
         text = '\n'.join(lines)
-        text = re.sub(r'\n\s*\t*\n*', '\n', text)
+        text = self.engine.empty_lines.sub('\n', text)
         return text.strip()
 
-    def write_json(self, json_data, f):
-        if self.filtering:
-            text = json_data['text']
-            is_clean_text, s = self.get_features(text)
-            if (is_clean_text and self.is_persian_text(s) and self.check_short_lines(text)
-                    and self.most_repeated_word_over_threshold(text)):
-                if not self.token_ratio_quality or self.token_ratio_quality_assessment(text):
-                    json.dump(json_data, f, ensure_ascii=False)
-                    f.write('\n')
+    def prefilter_reason(self, text: str):
+        if self.filtering and self.prefilter:
+            return timed(self.instrumentation, 'prefilter', self.quality_filter.prefilter, text)
+        return None
+
+    def dump_json(self, json_data, f, stats):
+        timed(self.instrumentation, 'json_write', f.write, json.dumps(json_data, ensure_ascii=False) + '\n')
+        stats['filtered_rows'] += 1
+        stats['filtered_words'] += len(json_data['text'].split())
+
+    def write_json(self, json_data, f, stats):
+        reason = timed(self.instrumentation, 'quality_filter', self.quality_filter.check,
+                       json_data['text']) if self.filtering else None
+        if reason is None and self.filtering and self.token_ratio_scorer is not None:
+            self.token_ratio_pending.append(json_data)
+            if len(self.token_ratio_pending) >= self.token_ratio_buffer:
+                self.flush_token_ratio(f, stats)
+        elif reason is None:
+            self.dump_json(json_data, f, stats)
         else:
-            json.dump(json_data, f, ensure_ascii=False)
-            f.write('\n')
+            stats['rejected'][reason] += 1
+        return reason
 
-    def preprocess_file(self, file_path: str):
-        file_name = os.path.splitext(os.path.basename(file_path))[0].replace(" ", "")
-        file_type = os.path.splitext(file_path)[-1]
+    def flush_token_ratio(self, f, stats):
+        # pending documents are written in their original order
+        if not self.token_ratio_pending:
+            return
+        passed = timed(self.instrumentation, 'token_ratio', self.token_ratio_scorer.assess,
+                       [json_data['text'] for json_data in self.token_ratio_pending])
+        for json_data, is_passed in zip(self.token_ratio_pending, passed):
+            if is_passed:
+                self.dump_json(json_data, f, stats)
+            else:
+                stats['rejected']['token_ratio'] += 1
+        self.token_ratio_pending = []
+
+    def count_row(self, text, stats):
+        # statistics of the input rows, collected while normalizing instead of in a separate pass
+        stats['rows'] += 1
+        if isinstance(text, str):
+            stats['words'] += len(text.split())
+            reason = self.prefilter_reason(text)
+        else:
+            reason = 'no_text'
+        if reason is not None:
+            stats['rejected'][reason] += 1
+        return reason is None
+
+    def output_path(self, file_path: str):
+        file_name = os.path.basename(strip_suffix(file_path)).replace(" ", "")
         source = os.path.dirname(file_path.split(self.data_path)[1])
+        return source, file_name, f'./result/normalized/{source}/{file_name}.jsonl{output_suffix(self.compression)}'
+
+    def preprocess_file(self, file_path: str, chunk=None):
+        # chunk is the (start byte, end byte, first line, part) of a large jsonl file, written to its own part file.
+        # stats['digest'] is the digest of the raw bytes that were read, the file or the byte range of the chunk
+        file_type = split_suffix(file_path)[0]
+        source, file_name, res_path = self.output_path(file_path)
         self.normalized_folder = f'./result/normalized/{source}'
-        res_path = f'{self.normalized_folder}/{file_name}.jsonl'
-        if not os.path.exists(self.normalized_folder):
-            os.makedirs(self.normalized_folder)
-        with open(file_path, 'r', encoding='utf-8') as fh:
-            with open(res_path, 'w', encoding='utf-8') as f:
-                if file_type == '.jsonl':
-                    for i, line in enumerate(fh):
-                        try:
-                            json_data = json.loads(line)
-                            json_data['id'] = f"{source}-{file_name}-{i}"
-                            if isinstance(json_data['text'], str):
-                                preprocessed_text = self.preprocess_document(json_data['text'], source)
-                                if preprocessed_text:
-                                    json_data['text'] = preprocessed_text
-                                    json_data['source'] = source
-                                    self.write_json(json_data, f)
-                        except json.decoder.JSONDecodeError:
-                            print("Error in reading file: ", file_path)
-                elif file_type == '.json':
+        out_path = res_path if chunk is None else part_path(res_path, chunk[3])
+        stats = new_stats()
+        digest = new_digest()
+        self.boilerplate_lines = 0
+        self.instrumentation = stats['instrumentation'] if self.instrument else None
+        stats['instrumentation'].source = source_group(source)
+        os.makedirs(self.normalized_folder, exist_ok=True)
+        with open_file(out_path, 'wt', self.compression, self.compression_level) as f:
+            if file_type == '.jsonl':
+                start, end, first_line = chunk[:3] if chunk else (0, os.path.getsize(file_path), 0)
+                for i, line in enumerate(iter_lines(file_path, start, end, digest), first_line):
                     try:
-                        json_datas = json.load(fh)
-                        for i, json_data in enumerate(json_datas):
-                            json_data['id'] = f"{source}-{file_name}-{i}"
-                            json_data['text'] = self.preprocess_line(json_data['text'], source)
-                            json_data['source'] = source
-                            self.write_json(json_data, f)
+                        json_data = timed(self.instrumentation, 'json_read', json.loads, line)
+                        json_data['id'] = f"{source}-{file_name}-{i}"
+                        if self.count_row(json_data['text'], stats):
+                            preprocessed_text = self.preprocess_document(json_data['text'], source,
+                                                                         self.instrumentation)
+                            if preprocessed_text:
+                                json_data['text'] = preprocessed_text
+                                json_data['source'] = source
+                                self.write_json(json_data, f, stats)
+                            else:
+                                stats['rejected']['empty'] += 1
                     except json.decoder.JSONDecodeError:
                         print("Error in reading file: ", file_path)
-                elif file_type == '.csv':
-                    try:
-                        csv_reader = csv.reader(fh)
-                        columns = next(csv_reader)
-                        for i, row in enumerate(csv_reader):
-                            json_data = {}
-                            for index in range(len(columns)):
-                                json_data[columns[index]] = row[index]
-                            json_data['id'] = f"{source}-{file_name}-{i}"
-                            json_data['source'] = source
-                            json_data['text'] = self.preprocess_line(json_data['text'], source)
-                            self.write_json(json_data, f)
-                    except Exception as e:
-                        print("Error in reading file: ", file_path, str(e))
-                elif file_type == '.parquet':
-                    try:
-                        df = pd.read_parquet(file_path)
-                        for i, row in df.iterrows():
-                            json_data = {}
-                            for column in df.columns:
-                                json_data[column] = row[column]
-                            json_data['id'] = f"{source}-{file_name}-{i}"
-                            json_data['source'] = source
-                            json_data['text'] = self.preprocess_line(json_data['text'], source)
-                            self.write_json(json_data, f)
-                    except Exception as e:
-                        print("Error in reading file: ", file_path, str(e))
-        #        print("finished : ", file_path)
-        return self.normalized_folder
-
-    def normalize_files(self, all_files: list[str]):
-        n_proc = cpu_count() - 1
+            elif file_type == '.json':
+                try:
+                    with HashingReader(file_path, digest) as raw, open_file(file_path, 'rt', fileobj=raw) as fh:
+                        json_datas = json.load(fh)
+                    for i, json_data in enumerate(json_datas):
+                        json_data['id'] = f"{source}-{file_name}-{i}"
+                        if not self.count_row(json_data['text'], stats):
+                            continue
+                        json_data['text'] = self.preprocess_line(json_data['text'], source, self.instrumentation)
+                        json_data['source'] = source
+                        self.write_json(json_data, f, stats)
+                except json.decoder.JSONDecodeError:
+                    print("Error in reading file: ", file_path)
+            elif file_type in ['.csv', '.parquet']:
+                try:
+                    rows = iter_rows(file_path, file_type, self.read_block_size, digest=digest)
+                    for i, json_data in enumerate(rows):
+                        json_data['id'] = f"{source}-{file_name}-{i}"
+                        json_data['source'] = source
+                        if not self.count_row(json_data['text'], stats):
+                            continue
+                        json_data['text'] = self.preprocess_line(json_data['text'], source, self.instrumentation)
+                        self.write_json(json_data, f, stats)
+                except Exception as e:
+                    print("Error in reading file: ", file_path, str(e))
+            if self.token_ratio_scorer is not None:
+                self.flush_token_ratio(f, stats)
+        self.instrumentation = None
+        stats['boilerplate_lines'] = self.boilerplate_lines
+        stats['digest'] = digest.hexdigest()
+        return stats
+
+    def worker_config(self):
+        # everything a pool process needs to build an equivalent Preprocessor
+        return {'kwargs': self.config,
+                'attributes': {'data_path': self.data_path, 'filtering': self.filtering,
+                               'spacy_batch_size': self.spacy_batch_size, 'read_block_size': self.read_block_size,
+                               'boilerplate_path': self.boilerplate_path},
+                # switches that do not change the output, left out of the manifest fingerprint
+                'runtime': {'instrument': self.instrument, 'profile_path': self.profile_path}}
+
+    def plan_tasks(self, all_files: list[str], pool):
+        # jsonl files larger than chunk_size are split in newline aligned byte ranges, the first line of every
+        # range is counted in parallel so ids stay the same. Largest tasks are scheduled first
+        tasks = []
+        chunked = {}
+        for file_path in all_files:
+            chunks = self.file_chunks(file_path)
+            if chunks is not None:
+                chunked[file_path] = chunks
+            else:
+                tasks.append((os.path.getsize(file_path), (file_path, None)))
+        counts = iter(pool.map(count_lines, [(file_path, start, end) for file_path, chunks in chunked.items()
+                                             for start, end in chunks]))
+        for file_path, chunks in chunked.items():
+            first_line = 0
+            for part, (start, end) in enumerate(chunks):
+                tasks.append((end - start, (file_path, (start, end, first_line, part))))
+                first_line += next(counts)
+        tasks.sort(key=lambda x: -x[0])
+        return [task for size, task in tasks], {file_path: len(chunks) for file_path, chunks in chunked.items()}
+
+    def file_chunks(self, file_path: str):
+        # byte ranges of a jsonl file larger than chunk_size, None for files that are normalized whole
+        if split_suffix(file_path) == ('.jsonl', None) and os.path.getsize(file_path) > self.chunk_size:
+            return plan_chunks(file_path, self.chunk_size)
+        return None
+
+    def pending_files(self, all_files: list[str], manifest: RunManifest, pool):
+        # files without an up to date output in the manifest, with their state. Files that were only touched keep
+        # their output, their digest is computed like the workers compute it while normalizing
+        manifest.prune(all_files)
+        states = {file_path: file_state(file_path) for file_path in all_files}
+        touched = [file_path for file_path in all_files if manifest.is_touched(file_path, states[file_path])]
+        digests = dict(zip(touched, pool.starmap(file_digest, [(file_path, self.file_chunks(file_path))
+                                                               for file_path in touched])))
+        pending = {}
+        for file_path in all_files:
+            if file_path in digests and manifest.is_done(file_path, states[file_path], digests[file_path]):
+                entry = manifest.files[file_path]
+                manifest.record(file_path, states[file_path], digests[file_path], entry['output'], entry['stats'],
+                                entry.get('sketch'))
+            elif not manifest.is_done(file_path, states[file_path]):
+                pending[file_path] = states[file_path]
+        return pending
+
+    def normalize_files(self, all_files: list[str], resume=True):
+        n_proc = self.resources.normalize_workers
         print(f"resetting to {n_proc} for number of processes")
-        with Pool(processes=n_proc) as pool:
+        total = new_stats()
+        config = self.worker_config()
+        manifest = RunManifest(self.manifest_path, config_fingerprint({'version': NORMALIZATION_VERSION,
+                                                                       'kwargs': config['kwargs'],
+                                                                       'attributes': config['attributes']}))
+        if not resume:
+            manifest.files = {}
+        if self.profile_path:
+            for path in [self.profile_path, f'{self.profile_path}.lock']:
+                if os.path.exists(path):
+                    os.remove(path)
+        start_time = time.time()
+        with Pool(processes=n_proc, initializer=init_worker, initargs=(config,)) as pool:
+            pending = self.pending_files(all_files, manifest, pool)
+            sketches = {}
+            if self.boilerplate_threshold and pending:
+                # the frequencies are counted over all files, also the ones that are already normalized. These are
+                # normalized again when the frequencies of their source changed
+                sketches = self.count_boilerplate(all_files, pool)
+                for file_path in [file_path for file_path in all_files if file_path not in pending]:
+                    entry = manifest.files[file_path]
+                    if entry.get('sketch') != sketches.get(self.output_path(file_path)[0]):
+                        pending[file_path] = entry['state']
+            print(f"{len(all_files) - len(pending)} of {len(all_files)} files are already normalized")
+            for file_path in all_files:
+                if file_path not in pending:
+                    merge_stats(total, manifest.files[file_path]['stats'])
+            tasks, chunked = self.plan_tasks(list(pending), pool)
+            remaining = {file_path: chunked.get(file_path, 1) for file_path in pending}
+            # digests of the byte ranges of every file, combined in file order once all of them are read
+            part_digests = {file_path: [None] * chunked.get(file_path, 1) for file_path in pending}
+            file_stats = {file_path: new_stats() for file_path in pending}
             pbar = tqdm(
-                pool.imap(
-                    self.preprocess_file, all_files
+                pool.imap_unordered(
+                    normalize_task, tasks
                 ),
-                total=len(all_files),
+                total=len(tasks),
             )
-            for test in pbar:
-                pbar.update()
-                if test:
-                    continue
+            for (file_path, chunk), stats in pbar:
+                part_digests[file_path][chunk[3] if chunk else 0] = stats.pop('digest')
+                merge_stats(total, stats)
+                merge_stats(file_stats[file_path], stats)
+                remaining[file_path] -= 1
+                if remaining[file_path] == 0:
+                    # a file is complete once all of its chunks are, only then it is recorded in the manifest
+                    res_path = self.output_path(file_path)[2]
+                    if file_path in chunked:
+                        merge_parts(res_path, chunked[file_path])
+                    manifest.record(file_path, pending[file_path], combine_digests(part_digests.pop(file_path)),
+                                    res_path, file_stats.pop(file_path), sketches.get(self.output_path(file_path)[0]))
+        manifest.save()
+        if self.profile_path and os.path.exists(f'{self.profile_path}.lock'):
+            os.remove(f'{self.profile_path}.lock')
+        # process time not spent building a Preprocessor or normalizing: dispatching, result transfer and idle time
+        total['overhead'] = n_proc * (time.time() - start_time) - total['startup'] - total['seconds']
+        total['processes'] = n_proc
+        return total
 
-    def preprocess_files(self, sub_folder_name: str, filtering=True):
+    def preprocess_files(self, sub_folder_name: str, filtering=True, resume=True, instrument=False, profile=False):
         start_time = time.time()
         data_dir = self.data_path + sub_folder_name
         all_files = get_all_files(data_dir)
         self.log_path = f'./result/logs/{sub_folder_name}.txt'
-        self.count_files(sub_folder_name)
+        self.manifest_path = f'./result/manifests/normalized/{sub_folder_name}.json'
+        self.boilerplate_path = f'./result/boilerplate/{sub_folder_name}'
         self.filtering = filtering
-        self.normalize_files(all_files)
-        count_words_filtered = 0
+        self.instrument = instrument
+        self.profile_path = f'./result/logs/{sub_folder_name}.prof' if profile else None
+        stats = self.normalize_files(all_files, resume)
+        self.number_of_total_rows = stats['rows']
+        self.number_of_filtered_rows = stats['filtered_rows']
         print("total : ", len(all_files))
-        for file_path in tqdm(all_files):
-            file_name = os.path.splitext(os.path.basename(file_path))[0].replace(" ", "")
-            source = os.path.dirname(file_path.split(self.data_path)[1])
-            self.normalized_folder = f'./result/normalized/{source}'
-            res_path = f'{self.normalized_folder}/{file_name}.jsonl'
-            with open(res_path, 'r', encoding='utf-8') as fh:
-                for i, line in enumerate(fh):
-                    json_data = json.loads(line)
-                    self.number_of_filtered_rows += 1
-                    count_words_filtered += len(json_data['text'].split())
-        with open(self.log_path, 'a', encoding='utf-8') as f:
-            f.write(f"Number of words after filtering: {count_words_filtered}\n")
-            f.write(f"Number of rows after filtering: : {self.number_of_filtered_rows}\n")
-            f.write(f"Normalizing Time: {(time.time() - start_time):.3f} s\n---------------------------\n")
-
-    def count_files(self, sub_folder_name: str):
-        data_dir = self.data_path + sub_folder_name
-        all_files = get_all_files(data_dir)
-        log_name = sub_folder_name
-        self.log_path = f'./result/logs/{log_name}.txt'
-        count_words = 0  # total number of words
-        number_of_rows = 0  # total number of rows
         if not os.path.exists('./result/logs'):
             os.makedirs('./result/logs')
         with open(self.log_path, 'w', encoding='utf-8') as f:
             f.write(f"Total files: {len(all_files)}\n")
-        for file_path in tqdm(all_files, desc="counting"):
-            file_type = os.path.splitext(file_path)[-1]
-            with open(file_path, 'r', encoding='utf-8') as fh:
-                if file_type == '.jsonl':
-                    for i, line in enumerate(fh):
-                        try:
-                            json_data = json.loads(line)
-                            number_of_rows += 1
-                            if isinstance(json_data['text'], str):
-                                count_words += len(json_data['text'].split())
-                        except json.decoder.JSONDecodeError:
-                            print("Error in reading file: ", file_path)
-                elif file_type == '.json':
-                    try:
-                        json_datas = json.load(fh)
-                        for i, json_data in enumerate(json_datas):
-                            number_of_rows += 1
-                            count_words += len(json_data['text'].split())
-                    except json.decoder.JSONDecodeError:
-                        print("Error in reading file: ", file_path)
-                elif file_type == '.csv':
-                    try:
-                        csv_reader = csv.reader(fh)
-                        columns = next(csv_reader)
-                        for i, row in enumerate(csv_reader):
-                            json_data = {}
-                            for index in range(len(columns)):
-                                json_data[columns[index]] = row[index]
-                            number_of_rows += 1
-                            count_words += len(json_data['text'].split())
-                    except Exception as e:
-                        print("Error in reading file: ", file_path, str(e))
-                elif file_type == '.parquet':
-                    try:
-                        df = pd.read_parquet(file_path)
-                        for i, row in df.iterrows():
-                            number_of_rows += 1
-                            count_words += len(row['text'].split())
-                    except Exception as e:
-                        print("Error in reading file: ", file_path, str(e))
-        with open(self.log_path, 'a', encoding='utf-8') as f:
-            f.write(f"Number of words before filtering: {count_words}\n")
-            f.write(f"Number of rows before filtering: : {number_of_rows}\n")
+            f.write(f"Resources: {self.resources.describe()}\n")
+            f.write(f"Number of words before filtering: {stats['words']}\n")
+            f.write(f"Number of rows before filtering: : {stats['rows']}\n")
+            f.write(f"Number of words after filtering: {stats['filtered_words']}\n")
+            f.write(f"Number of rows after filtering: : {stats['filtered_rows']}\n")
+            f.write(f"Rejected rows: {dict(stats['rejected'].most_common())}\n")
+            f.write(f"Boilerplate lines removed: {stats['boilerplate_lines']}\n")
+            f.write(f"Worker startup: {stats['startup']:.3f} s in {stats['processes']} processes, "
+                    f"task time: {stats['seconds']:.3f} s in {stats['tasks']} tasks, "
+                    f"overhead: {stats['overhead'] / max(stats['tasks'], 1):.3f} s per task\n")
+            f.write(f"Normalizing Time: {(time.time() - start_time):.3f} s\n---------------------------\n")
+        if instrument:
+            stats['instrumentation'].write(f'./result/logs/{sub_folder_name}.normalization.json')
@@ -0,0 +1,55 @@
+import re
+import string
+from collections import Counter
+
+# punctuation deleted before counting words, the two tables of the old get_features merged into one
+_punctuation_table = str.maketrans("", "", string.punctuation + ":><؟!.،,?..,?!%;:-()[]{}$@#^&*")
+_persian_table = str.maketrans("", "", ''.join(map(chr, range(0x0600, 0x0700))))
+_words_pattern = re.compile(r'\w+')
+
+REASONS = ['short', 'non_persian', 'short_lines', 'repeated_word', 'token_ratio', 'raw_short', 'raw_non_persian']
+
+
+class QualityFilter:
+    # document level quality checks, cheapest first. check returns the reason of the first failed check or None.
+    # The token ratio check is the most expensive one and is batched separately (token_ratio.TokenRatioScorer)
+    def __init__(self, threshold=100, char_threshold=35, min_threshold=50, line_threshold=20, prefilter_margin=0.5):
+        self.threshold = threshold  # minimum number of words
+        self.char_threshold = char_threshold  # minimum percentage of persian characters
+        self.min_threshold = min_threshold  # maximum percentage of short lines and of the most repeated word
+        self.line_threshold = line_threshold  # number of words in each line
+        self.prefilter_margin = prefilter_margin
+
+    def persian_percentage(self, text: str, total_chars: int):
+        persian_chars = len(text) - len(text.translate(_persian_table))
+        return (persian_chars / total_chars) * 100 if total_chars > 0 else 0
+
+    def check(self, text: str):
+        # every word survives the punctuation deletion at most once, so this split bounds the real count
+        if len(text.split()) <= self.threshold:
+            return 'short'
+        features = text.lower().translate(_punctuation_table)
+        words = features.split()
+        if len(words) <= self.threshold:
+            return 'short'
+        # same length as the features with consecutive spaces collapsed and stripped
+        if self.persian_percentage(features, sum(map(len, words)) + len(words) - 1) <= self.char_threshold:
+            return 'non_persian'
+        lines = text.split('\n')
+        short_line_count = sum(1 for line in lines if len(line.split()) < self.line_threshold)
+        if (short_line_count / len(lines)) * 100 >= self.min_threshold:
+            return 'short_lines'
+        all_words = _words_pattern.findall(text)
+        if not all_words or (max(Counter(all_words).values()) / len(all_words)) * 100 >= self.min_threshold:
+            return 'repeated_word'
+        return None
+
+    def prefilter(self, text: str):
+        # raw text before normalization, only documents far below the thresholds are dropped since the
+        # normalization both removes (tags, emojis, latin words) and splits (punctuation) words
+        words = text.split()
+        if len(words) < self.threshold * self.prefilter_margin:
+            return 'raw_short'
+        if self.persian_percentage(text, len(text)) < self.char_threshold * self.prefilter_margin:
+            return 'raw_non_persian'
+        return None
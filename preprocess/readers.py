@@ -0,0 +1,45 @@
+import csv
+
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+from pyarrow import parquet as pq
+
+from .compression import HashingReader, open_file
+
+
+def iter_parquet_batches(file_path: str, batch_size=4096, digest=None):
+    # the file is memory mapped, hashing it reads the pages the row groups are then decoded from
+    with pa.memory_map(file_path) as source:
+        if digest is not None:
+            digest.update(source.read_buffer())
+            source.seek(0)
+        parquet_file = pq.ParquetFile(source)
+        for batch in parquet_file.iter_batches(batch_size=batch_size):
+            yield batch.to_pylist()
+
+
+def iter_csv_batches(file_path: str, block_size=1 << 26, digest=None):
+    # every column is read as a string like csv.reader does, a single row must fit in one block. The raw bytes
+    # are read, and added to digest, in python and '.csv.gz' and '.csv.zst' files are decompressed by open_file
+    with open_file(file_path, 'rt', newline='') as fh:
+        columns = next(csv.reader(fh))
+    with HashingReader(file_path, digest) as raw, open_file(file_path, 'rb', fileobj=raw) as fh:
+        reader = pa_csv.open_csv(
+            fh,
+            read_options=pa_csv.ReadOptions(block_size=block_size),
+            parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+            convert_options=pa_csv.ConvertOptions(column_types={column: pa.string() for column in columns},
+                                                  strings_can_be_null=False, quoted_strings_can_be_null=False))
+        for batch in reader:
+            yield batch.to_pylist()
+
+
+def iter_rows(file_path: str, file_type: str, block_size=1 << 26, batch_size=4096, digest=None):
+    # rows of a '.csv' or '.parquet' file as dicts, read in record batches of bounded size. The raw bytes of the
+    # file are added to digest (a hashlib object)
+    if file_type == '.csv':
+        batches = iter_csv_batches(file_path, block_size, digest)
+    else:
+        batches = iter_parquet_batches(file_path, batch_size, digest)
+    for batch in batches:
+        yield from batch
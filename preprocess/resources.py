@@ -0,0 +1,97 @@
+import json
+import os
+
+# every setting is also read from HODHOD_<NAME> in the environment, e.g. HODHOD_HASH_WORKERS=12
+ENV_PREFIX = 'HODHOD_'
+FIELDS = ['cpus', 'memory', 'normalize_workers', 'worker_memory', 'hash_workers', 'merge_workers',
+          'rewrite_workers', 'dedup_memory']
+
+
+def _read_int(path: str):
+    try:
+        with open(path, 'r') as f:
+            value = f.read().split()
+    except OSError:
+        return None
+    if not value or value[0] == 'max':
+        return None
+    return int(value[0])
+
+
+def cgroup_cpus():
+    # cpu quota of the container (cgroup v2, then v1), None without a limit
+    try:
+        with open('/sys/fs/cgroup/cpu.max', 'r') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    quota = _read_int('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+    period = _read_int('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if quota is not None and quota > 0 and period:
+        return quota / period
+    return None
+
+
+def cgroup_memory():
+    # memory limit of the container in bytes (cgroup v2, then v1), None without a limit
+    limit = _read_int('/sys/fs/cgroup/memory.max')
+    if limit is None:
+        limit = _read_int('/sys/fs/cgroup/memory/memory.limit_in_bytes')
+    # cgroup v1 reports no limit as a huge page aligned number
+    return limit if limit is not None and limit < 1 << 60 else None
+
+
+def available_cpus():
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    quota = cgroup_cpus()
+    if quota is not None:
+        cpus = min(cpus, int(quota))
+    return max(1, cpus)
+
+
+def available_memory():
+    memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    limit = cgroup_memory()
+    return min(memory, limit) if limit is not None else memory
+
+
+class Resources:
+    # processes and memory budgets of every stage. Unset values are sized from the cores and memory the process
+    # may use (cpu affinity and cgroup limits), set values win in the order: config file, environment, arguments
+    def __init__(self, cpus=None, memory=None, normalize_workers=None, worker_memory=None, hash_workers=None,
+                 merge_workers=None, rewrite_workers=None, dedup_memory=None):
+        self.cpus = cpus or available_cpus()
+        self.memory = memory or available_memory()  # bytes
+        self.worker_memory = worker_memory or 1 << 30  # bytes a normalization process needs with its models
+        # one core is left to the parent, and no more processes than fit in memory
+        self.normalize_workers = normalize_workers or max(1, min(self.cpus - 1, self.memory // self.worker_memory))
+        # the band workers of the memory bucketing mostly wait for blocks, the hash workers get the cores
+        self.hash_workers = hash_workers or max(1, self.cpus - 1)
+        self.merge_workers = merge_workers or self.cpus  # bounded by the number of bands
+        self.rewrite_workers = rewrite_workers or self.cpus
+        # band records buffered by the hash workers or merged on disk, a quarter of the memory up to 4 GB
+        self.dedup_memory = dedup_memory or min(self.memory // 4, 4 << 30)
+
+    @classmethod
+    def load(cls, config_path=None, **overrides):
+        values = {}
+        if config_path:
+            with open(config_path, 'r', encoding='utf-8') as f:
+                values.update(json.load(f))
+        unknown = set(values) - set(FIELDS)
+        if unknown:
+            raise ValueError(f"unknown resource settings in {config_path}: {sorted(unknown)}, expected {FIELDS}")
+        for name in FIELDS:
+            value = os.environ.get(ENV_PREFIX + name.upper())
+            if value:
+                values[name] = int(value)
+        values.update({name: value for name, value in overrides.items() if value is not None})
+        return cls(**values)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in FIELDS}
+
+    def describe(self):
+        return ', '.join(f'{name}={value}' for name, value in self.to_dict().items())
@@ -0,0 +1,168 @@
+import json
+import os
+import shutil
+from glob import glob
+
+import numpy as np
+
+from .manifest import file_digest, file_state, write_json_atomic
+
+ROW_BITS = 32
+
+
+def doc_id(file_index: int, row: int):
+    return (file_index << ROW_BITS) | row
+
+
+def split_doc_ids(doc_ids: np.ndarray):
+    return doc_ids >> np.uint64(ROW_BITS), doc_ids & np.uint64((1 << ROW_BITS) - 1)
+
+
+SEGMENT_KINDS = ['bands', 'offsets', 'words']
+
+
+class SignatureStore:
+    # registry of the deduplicated files and their band digests. Every file gets a stable integer index and
+    # every document the id (file index << 32 | row). The segment of a file holds the raw (rows, BAND) uint64
+    # digests, the uint64 byte offset of every line and the uint32 word count of every document. Offsets and the
+    # 'bytes' of a file are counted in its decompressed content. With n_signatures the segments written also keep
+    # the (rows, n_signatures) uint32 MinHash values of every document, read by the near duplicate index. They are
+    # optional per file and not part of the config, files hashed without them get them when hashed again
+    def __init__(self, folder: str, config: dict, n_signatures=0):
+        self.folder = folder
+        self.manifest_path = f'{folder}/store.json'
+        self.config = config
+        self.n_signatures = n_signatures
+        self.kinds = SEGMENT_KINDS + (['signatures'] if n_signatures else [])
+        self.files = {}
+        self.next_index = 0
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest['config'] == config:
+                self.files = manifest['files']
+                self.next_index = manifest['next_index']
+            else:
+                # signatures of another scheme or band layout can not be compared with new ones
+                self.clear()
+        os.makedirs(self.folder, exist_ok=True)
+        self.load_markers()
+
+    def load_markers(self):
+        # segments completed by a run that did not reach commit, e.g. because it crashed
+        for marker_path in glob(f'{self.folder}/*.done'):
+            with open(marker_path, 'r', encoding='utf-8') as f:
+                marker = json.load(f)
+            self.files[marker['path']] = {'index': marker['index'], 'state': marker['state'],
+                                          'hash': marker['hash'], 'rows': marker['rows'], 'bytes': marker['bytes']}
+            self.next_index = max(self.next_index, marker['index'] + 1)
+
+    def clear(self):
+        if os.path.exists(self.folder):
+            shutil.rmtree(self.folder)
+        os.makedirs(self.folder)
+        self.files = {}
+        self.next_index = 0
+
+    def register(self, file_paths: list[str]):
+        for file_path in file_paths:
+            if file_path not in self.files:
+                self.files[file_path] = {'index': self.next_index}
+                self.next_index += 1
+
+    def file_index(self, file_path: str):
+        return self.files[file_path]['index']
+
+    def file_paths(self):
+        return {entry['index']: file_path for file_path, entry in self.files.items()}
+
+    @staticmethod
+    def file_state(file_path: str):
+        return file_state(file_path)
+
+    def segment_path(self, file_path: str, kind='bands'):
+        return f'{self.folder}/{self.file_index(file_path)}.{kind}'
+
+    def is_current(self, file_path: str):
+        entry = self.files.get(file_path, {})
+        return entry.get('state') == self.file_state(file_path)
+
+    def refresh(self, file_paths: list[str], pool):
+        # files whose size or mtime changed but whose content did not keep their segments
+        changed = [file_path for file_path in file_paths
+                   if 'hash' in self.files[file_path] and not self.is_current(file_path)]
+        for file_path, digest in zip(changed, pool.map(file_digest, changed)):
+            if digest == self.files[file_path]['hash']:
+                self.files[file_path]['state'] = self.file_state(file_path)
+
+    def mark_done(self, file_path: str, n_bytes: int, digest: str):
+        # called by a worker once the segment of a file is complete, n_bytes is the length of the decompressed file
+        # and digest the digest of its raw bytes, computed while they were read
+        segment_bytes = os.path.getsize(self.segment_path(file_path))
+        write_json_atomic({'path': file_path, 'index': self.file_index(file_path), 'state': self.file_state(file_path),
+                           'hash': digest, 'rows': segment_bytes // 8 // self.config['band'],
+                           'bytes': n_bytes},
+                          self.segment_path(file_path, 'done'))
+
+    def has_signatures(self, file_path: str):
+        return os.path.exists(self.segment_path(file_path, 'signatures'))
+
+    def open_segment(self, file_path: str):
+        return SegmentWriter(self, file_path)
+
+    def read_segment(self, file_path: str):
+        if not self.files[file_path]['rows']:
+            return np.empty((0, self.config['band']), dtype=np.uint64)
+        return np.memmap(self.segment_path(file_path), dtype=np.uint64, mode='r').reshape(-1, self.config['band'])
+
+    def write_digests(self, file_path: str, digests: np.ndarray):
+        # text digests of the exact deduplication, valid for the state of the file they were computed from. Runs
+        # without the exact stage hash changed files without rewriting them
+        digests.tofile(self.segment_path(file_path, 'digests'))
+        write_json_atomic(self.file_state(file_path), self.segment_path(file_path, 'digests.json'))
+
+    def read_digests(self, file_path: str):
+        state_path = self.segment_path(file_path, 'digests.json')
+        if not os.path.exists(state_path):
+            return None
+        with open(state_path, 'r', encoding='utf-8') as f:
+            if json.load(f) != self.file_state(file_path):
+                return None
+        return np.fromfile(self.segment_path(file_path, 'digests'), dtype=np.uint64).reshape(-1, 2)
+
+    def commit(self, file_paths: list[str]):
+        # called by the parent once every worker finished, drops segments of files that left the corpus
+        self.load_markers()
+        for file_path in set(self.files) - set(file_paths):
+            for kind in SEGMENT_KINDS + ['signatures', 'digests', 'digests.json', 'done']:
+                if os.path.exists(self.segment_path(file_path, kind)):
+                    os.remove(self.segment_path(file_path, kind))
+            del self.files[file_path]
+        write_json_atomic({'config': self.config, 'next_index': self.next_index, 'files': self.files},
+                          self.manifest_path)
+        [os.remove(marker_path) for marker_path in glob(f'{self.folder}/*.done')]
+
+
+class SegmentWriter:
+    def __init__(self, store: SignatureStore, file_path: str):
+        self.files = {kind: open(store.segment_path(file_path, kind), 'wb') for kind in store.kinds}
+        if 'signatures' not in self.files and store.has_signatures(file_path):
+            # the signatures of the previous content of the file
+            os.remove(store.segment_path(file_path, 'signatures'))
+        self.position = 0
+
+    def append(self, band_keys: np.ndarray, line_lengths: list[int], word_counts: list[int], signatures=None):
+        band_keys.tofile(self.files['bands'])
+        if 'signatures' in self.files:
+            # MinHash values are below 2^32
+            signatures.astype(np.uint32).tofile(self.files['signatures'])
+        lengths = np.array(line_lengths, dtype=np.uint64)
+        (np.cumsum(lengths) - lengths + np.uint64(self.position)).tofile(self.files['offsets'])
+        self.position += int(lengths.sum())
+        np.array(word_counts, dtype=np.uint32).tofile(self.files['words'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        [f.close() for f in self.files.values()]
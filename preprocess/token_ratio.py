@@ -0,0 +1,35 @@
+import re
+
+_word_pattern = re.compile(r'\w')
+
+
+class TokenRatioScorer:
+    # characters per XLM-R token, a document passes when len(text) / tokens >= filter_th. Documents are
+    # tokenized in batches of similar length through the fast tokenizer, only the number of ids is kept
+    def __init__(self, tokenizer, filter_th=3, batch_size=64):
+        self.tokenizer = tokenizer
+        self.filter_th = filter_th
+        self.batch_size = batch_size
+
+    def min_tokens(self, text: str):
+        # every whitespace separated word with a letter or digit starts at least one sentencepiece token
+        return sum(1 for word in text.split() if _word_pattern.search(word))
+
+    def token_counts(self, texts: list[str]):
+        counts = [0] * len(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            encoded = self.tokenizer([texts[i] for i in batch], add_special_tokens=False,
+                                     return_attention_mask=False, return_token_type_ids=False)
+            for i, ids in zip(batch, encoded['input_ids']):
+                counts[i] = len(ids)
+        return counts
+
+    def assess(self, texts: list[str]):
+        # documents whose ratio is below the threshold even with the fewest possible tokens are not tokenized
+        results = [False] * len(texts)
+        uncertain = [i for i, text in enumerate(texts) if len(text) >= self.filter_th * self.min_tokens(text)]
+        for i, tokens in zip(uncertain, self.token_counts([texts[i] for i in uncertain])):
+            results[i] = tokens > 0 and len(texts[i]) / tokens >= self.filter_th
+        return results
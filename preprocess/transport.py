@@ -0,0 +1,96 @@
+import json
+import os
+import queue
+import time
+from multiprocessing import Array, Event, Queue, shared_memory
+
+import numpy as np
+
+
+class BlockTransport:
+    # fixed size blocks of (document id, band digests...) rows in shared memory, passed whole from the hash
+    # workers to the band workers. A producer waits for a free block (backpressure), fills it and sends its
+    # number to every consumer; the block is free again once the last consumer released it. Every producer
+    # ends its stream with None, so consumers stop after n_producers of them instead of waiting for a timeout.
+    # A consumer that dies never releases its blocks, the parent then aborts the transport and the producers
+    # waiting for a free block fail instead of waiting forever
+    def __init__(self, n_producers: int, n_consumers: int, width: int, block_rows=4096, n_blocks=32):
+        self.n_producers = n_producers
+        self.n_consumers = n_consumers
+        self.block_rows = block_rows
+        self.memory = shared_memory.SharedMemory(create=True, size=n_blocks * block_rows * width * 8)
+        self.blocks = np.ndarray((n_blocks, block_rows, width), dtype=np.uint64, buffer=self.memory.buf)
+        self.free = Queue()
+        [self.free.put(block) for block in range(n_blocks)]
+        self.readers = Array('i', n_blocks)
+        self.queues = [Queue() for _ in range(n_consumers)]
+        self.aborted = Event()
+
+    def acquire(self, poll_seconds=1.0):
+        while True:
+            try:
+                return self.free.get(timeout=poll_seconds)
+            except queue.Empty:
+                if self.aborted.is_set():
+                    raise RuntimeError("the block transport was aborted because a consumer failed")
+
+    def abort(self):
+        self.aborted.set()
+
+    def send(self, block: int, n_rows: int):
+        self.readers[block] = self.n_consumers
+        for consumer_queue in self.queues:
+            consumer_queue.put((block, n_rows))
+
+    def end_stream(self):
+        for consumer_queue in self.queues:
+            consumer_queue.put(None)
+
+    def receive(self, consumer: int):
+        return self.queues[consumer].get()
+
+    def release(self, block: int):
+        with self.readers.get_lock():
+            self.readers[block] -= 1
+            if self.readers[block] == 0:
+                self.free.put(block)
+
+    def close(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+class TransportStats:
+    # blocks, rows and messages moved by one worker and the seconds it was blocked on the transport
+    def __init__(self, name: str):
+        self.name = name
+        self.blocks = 0
+        self.rows = 0
+        self.messages = 0
+        self.blocked = 0.0
+        self.start = time.perf_counter()
+
+    def wait(self, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.blocked += time.perf_counter() - start
+        return result
+
+    def add(self, n_rows: int, n_messages: int):
+        self.blocks += 1
+        self.rows += n_rows
+        self.messages += n_messages
+
+    def write(self, folder: str):
+        os.makedirs(folder, exist_ok=True)
+        with open(f'{folder}/{self.name}.json', 'w', encoding='utf-8') as f:
+            json.dump({'name': self.name, 'blocks': self.blocks, 'rows': self.rows, 'messages': self.messages,
+                       'blocked': self.blocked, 'seconds': time.perf_counter() - self.start}, f)
+
+
+def read_transport_stats(folder: str):
+    stats = []
+    for name in sorted(os.listdir(folder)) if os.path.exists(folder) else []:
+        with open(f'{folder}/{name}', 'r', encoding='utf-8') as f:
+            stats.append(json.load(f))
+    return stats